@@ -0,0 +1,119 @@
+"""Compare the shared html extractor with the per-spider ::text flattening.
+
+Runs both over saved chapter html: files or directories of *.html passed as
+arguments, every page in the spiders' http cache (data/cache/http) with
+--http-cache, or by default the pages in benchmarks/fixtures, one per spider
+layout. Parsing is timed separately from extraction, since both approaches
+share it.
+
+    rye run bench_extract [chapter.html | fixtures/ ...] [--repeat 5]
+    rye run bench_extract --http-cache
+"""
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+
+from parsel import Selector
+
+from pipeline.scraping.extract import extract_text
+from pipeline.scraping.httpcache import HTTP_CACHE_DIR
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load_fixtures(paths: list[str], http_cache: bool = False) -> list[str]:
+    pages = []
+    if http_cache:
+        for path in glob.glob(os.path.join(HTTP_CACHE_DIR, "*", "*", "*")):
+            with gzip.open(os.path.join(path, "response_body"), "rb") as f:
+                pages.append(f.read().decode("utf-8", errors="replace"))
+    for path in paths:
+        files = (
+            glob.glob(os.path.join(path, "*.html")) if os.path.isdir(path) else [path]
+        )
+        for file_name in files:
+            with open(file_name, "r") as f:
+                pages.append(f.read())
+    return pages
+
+
+def sections(selector: Selector):
+    # the cisco docs layout, otherwise the whole page
+    return selector.css("article.nested1") or selector.css("body")
+
+
+def text_selectors(selector: Selector) -> str:
+    """What the spiders did before pipeline.scraping.extract"""
+    text_data = ""
+    for section in sections(selector):
+        text = section.css("::text").getall()
+        text = " ".join([text.strip() for text in text if text.strip()])
+        text = text.replace("\r", "").replace("\t", "").replace("\n", " ")
+        text = " ".join(text.split())
+        text_data += "\n\n" + text
+    return text_data
+
+
+def tree_walk(selector: Selector) -> str:
+    text_data = ""
+    for section in sections(selector):
+        text_data += "\n\n" + extract_text(section)
+    return text_data
+
+
+def run(pages: list[str], repeat: int) -> list[dict]:
+    size = sum(len(p.encode("utf-8")) for p in pages) / 2**20
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        selectors = [Selector(text=page) for page in pages]
+    parse = (time.perf_counter() - start) / repeat
+
+    results = [{"method": "parse", "seconds": round(parse, 4)}]
+    for name, fn in (("text_selectors", text_selectors), ("tree_walk", tree_walk)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            chars = sum(len(fn(s)) for s in selectors)
+        elapsed = (time.perf_counter() - start) / repeat
+        results.append(
+            {
+                "method": name,
+                "seconds": round(elapsed, 4),
+                "pages_per_second": round(len(pages) / elapsed, 1),
+                "mb_per_second": round(size / elapsed, 2),
+                "chars": chars,
+            }
+        )
+    for result in results:
+        logging.info(json.dumps(result))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("paths", nargs="*", help="html files or directories")
+    parser.add_argument(
+        "--http-cache", action="store_true", help="every page the spiders cached"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    paths = args.paths or ([] if args.http_cache else [FIXTURES_DIR])
+    pages = load_fixtures(paths, args.http_cache)
+    if not pages:
+        logging.error("no html found, pass some files or run a scrape first")
+        return
+    logging.info(f"⏱ extracting {len(pages)} pages")
+    run(pages, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
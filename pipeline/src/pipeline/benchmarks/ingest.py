@@ -0,0 +1,410 @@
+"""Offline ingest benchmark.
+
+Runs the ingest stages on stand-ins so throughput can be measured without
+OpenAI credits or the production Qdrant: a deterministic fake embedder with
+configurable latency, an in-memory (or local) Qdrant and synthetic corpora
+shaped like data/queue/docs.json, pdfs.json and urls.json.
+
+Each stage (split, embed, upsert and the full streaming ingest) reports
+chunks per second, embedding requests, upsert latency and peak RSS. Results
+are compared against the baseline in data/bench/ingest.json, which the first
+run on a machine writes, and which is written again with --save after a
+change that is meant to move the numbers.
+
+    rye run bench_ingest --scale 2 --latency 0.2
+    rye run bench_ingest --save data/bench/ingest.json
+    rye run bench_ingest --baseline data/bench/other.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+
+from langchain.schema import Document
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from qdrant_client.models import PointStruct
+
+from pipeline import ingest
+from pipeline.embeddings import (
+    EMBEDDING_CONCURRENCY,
+    HashingEmbeddingBackend,
+    embed_cached,
+)
+from pipeline.stream import ordered_map
+from pipeline.tokens import batch_by_tokens, text_splitter, tiktoken_len, tokenizer
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+BENCH_BASELINE = os.getenv("BENCH_BASELINE") or "data/bench/ingest.json"
+
+WORDS = (
+    "cisco secure firewall threat defense management center policy access "
+    "control rule interface zone network object vpn tunnel certificate "
+    "identity umbrella duo authentication device configure deploy upgrade "
+    "cluster high availability failover routing bgp ospf nat snmp syslog "
+    "event intrusion malware file sandbox dashboard report api version "
+    "license smart account appliance virtual cloud aws azure tenant user"
+).split()
+
+
+class FakeEmbeddings(HashingEmbeddingBackend):
+    """The hashing embedding backend, plus a sleep of `latency` seconds per
+    call to mimic the round trip to the api, and a count of the calls.
+    """
+
+    def __init__(self, dimension: int = 1536, latency: float = 0.0):
+        super().__init__(dimension)
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+
+class RSSSampler:
+    """Samples the resident set size in a background thread to find a peak"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+def current_rss() -> int:
+    """Current resident set size in bytes"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (FileNotFoundError, ValueError):
+        # no procfs (e.g. macos), fall back to the process high water mark
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def paragraphs(rng: random.Random, count: int) -> str:
+    return "\n\n".join(
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 250)))
+        for _ in range(count)
+    )
+
+
+def synthetic_corpus(scale: int = 1, seed: int = 0) -> dict[str, list[dict]]:
+    """Queue entries with the documents they load, shaped like data/queue/*.json.
+
+    docs are guides split into many chapter sections, pdfs are single large
+    documents carrying Cisco Live metadata and urls are one medium page each.
+    """
+    rng = random.Random(seed)
+    corpus: dict[str, list[dict]] = {"docs": [], "pdfs": [], "urls": []}
+
+    for g in range(2 * scale):
+        base = f"https://www.cisco.com/c/en/us/td/docs/security/guide-{g}"
+        entry = {
+            "source": f"{base}/index.html",
+            "slug": f"guide-{g}",
+            "products": ["firepower", "ftd"],
+            "title": f"Cisco Secure Firewall Guide {g}",
+            "version": "7.4",
+        }
+        documents = [
+            Document(
+                page_content=paragraphs(rng, rng.randint(3, 30)),
+                metadata={
+                    **entry,
+                    "title": entry["title"],
+                    "subtitle": f"Chapter {c}",
+                    "source": f"{base}/chapter-{c}.html",
+                    "versions": ["7.4"],
+                },
+            )
+            for c in range(40)
+        ]
+        corpus["docs"].append({"entry": entry, "documents": documents})
+
+    for p in range(10 * scale):
+        entry = {
+            "source": f"https://www.ciscolive.com/c/dam/r/ciscolive/global-event/docs/2023/pdf/BRKSEC-{2000 + p}.pdf",
+            "title": f"Session BRKSEC-{2000 + p}",
+            "subtitle": "Cisco Live 2023 Las Vegas",
+            "event": ["2023 Las Vegas"],
+            "technology": ["Security"],
+            "session type": ["Breakout"],
+            "technical level": ["Intermediate"],
+        }
+        documents = [Document(page_content=paragraphs(rng, 400), metadata=entry)]
+        corpus["pdfs"].append({"entry": entry, "documents": documents})
+
+    for u in range(5 * scale):
+        entry = {
+            "source": f"https://www.cisco.com/c/en/us/td/docs/security/page-{u}.html",
+            "products": ["workload", "secure workload"],
+            "title": f"Cisco Secure Workload Guide {u}",
+        }
+        documents = [Document(page_content=paragraphs(rng, 60), metadata=entry)]
+        corpus["urls"].append({"entry": entry, "documents": documents})
+
+    return corpus
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def bench_split(documents: list[Document]) -> tuple[dict, list[Document]]:
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        chunks = text_splitter.split_documents(documents)
+        elapsed = time.perf_counter() - start
+    return {
+        "seconds": elapsed,
+        "chunks": len(chunks),
+        "chunks_per_second": len(chunks) / elapsed if elapsed else 0,
+        "peak_rss_mb": rss.peak / 2**20,
+    }, chunks
+
+
+def bench_embed(
+    embed: FakeEmbeddings, chunks: list[Document]
+) -> tuple[dict, list[list[float]]]:
+    embed.requests = 0
+    vectors: list[list[float]] = []
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        batches = batch_by_tokens(
+            ((c.page_content, tiktoken_len(c.page_content)) for c in chunks),
+            length=lambda item: item[1],
+        )
+        for _, batch_vectors in ordered_map(
+            lambda batch: embed_cached(
+                embed, [t for t, _ in batch], tokens=sum(n for _, n in batch)
+            ),
+            batches,
+            EMBEDDING_CONCURRENCY,
+        ):
+            vectors.extend(batch_vectors)
+        elapsed = time.perf_counter() - start
+    return {
+        "seconds": elapsed,
+        "chunks": len(chunks),
+        "chunks_per_second": len(chunks) / elapsed if elapsed else 0,
+        "embedding_requests": embed.requests,
+        "peak_rss_mb": rss.peak / 2**20,
+    }, vectors
+
+
+def bench_upsert(
+    client: QdrantClient,
+    chunks: list[Document],
+    vectors: list[list[float]],
+    batch_size: int = 256,
+) -> dict:
+    latencies = []
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        for i in range(0, len(chunks), batch_size):
+            points = [
+                PointStruct(
+                    id=ingest.point_id("bench", i + j, chunk.page_content),
+                    vector=vector,
+                    payload=ingest.slim_payload(chunk),
+                )
+                for j, (chunk, vector) in enumerate(
+                    zip(chunks[i : i + batch_size], vectors[i : i + batch_size])
+                )
+            ]
+            call = time.perf_counter()
+            client.upsert(collection_name=ingest.collection_name, points=points)
+            latencies.append(time.perf_counter() - call)
+        elapsed = time.perf_counter() - start
+    return {
+        "seconds": elapsed,
+        "chunks": len(chunks),
+        "chunks_per_second": len(chunks) / elapsed if elapsed else 0,
+        "upsert_calls": len(latencies),
+        "upsert_p50_ms": percentile(latencies, 50) * 1000,
+        "upsert_p99_ms": percentile(latencies, 99) * 1000,
+        "peak_rss_mb": rss.peak / 2**20,
+    }
+
+
+def bench_ingest(
+    client: QdrantClient, embed: FakeEmbeddings, items: list[dict]
+) -> dict:
+    embed.requests = 0
+    chunks = 0
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        for item in items:
+            stats = ingest.ingest_source(
+                client,
+                embed,
+                item["entry"]["source"],
+                iter(item["documents"]),
+                set(),
+            )
+            chunks += stats["chunks"]
+        elapsed = time.perf_counter() - start
+    return {
+        "seconds": elapsed,
+        "chunks": chunks,
+        "chunks_per_second": chunks / elapsed if elapsed else 0,
+        "embedding_requests": embed.requests,
+        "peak_rss_mb": rss.peak / 2**20,
+    }
+
+
+def new_client(url: str | None, dimension: int) -> QdrantClient:
+    client = QdrantClient(url=url) if url else QdrantClient(":memory:")
+    if url:
+        # start from nothing, the collections are aliases of generations
+        aliases = ingest.get_aliases(client)
+        names = (ingest.collection_name, ingest.documents_collection_name)
+        operations = [
+            models.DeleteAliasOperation(
+                delete_alias=models.DeleteAlias(alias_name=alias)
+            )
+            for alias in names
+            if alias in aliases
+        ]
+        if operations:
+            client.update_collection_aliases(change_aliases_operations=operations)
+        ingest.collect_generations(client, keep=0)
+        # and collections from before generations
+        for name in names:
+            client.delete_collection(name)
+    model, dimension = FakeEmbeddings.describe(dimension)
+    ingest.create_collection(client, dimension, model=model)
+    return client
+
+
+def run(args) -> dict:
+    corpus = synthetic_corpus(args.scale, args.seed)
+    embed = FakeEmbeddings(dimension=args.dimension, latency=args.latency)
+    results: dict[str, dict] = {}
+
+    for type, items in corpus.items():
+        documents = [d for item in items for d in item["documents"]]
+        split, chunks = bench_split(documents)
+        embedded, vectors = bench_embed(embed, chunks)
+        upserted = bench_upsert(
+            new_client(args.qdrant_url, args.dimension), chunks, vectors
+        )
+        ingested = bench_ingest(
+            new_client(args.qdrant_url, args.dimension), embed, items
+        )
+        results[type] = {
+            "split": split,
+            "embed": embedded,
+            "upsert": upserted,
+            "ingest": ingested,
+        }
+        for stage, metrics in results[type].items():
+            logging.info(
+                f"⏱ {type}/{stage}: "
+                + ", ".join(
+                    f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}"
+                    for k, v in metrics.items()
+                )
+            )
+
+    return results
+
+
+def run_info(args) -> dict:
+    """What a result was measured with, throughput only compares on like
+    machines and settings
+    """
+    return {
+        "scale": args.scale,
+        "seed": args.seed,
+        "dimension": args.dimension,
+        "latency": args.latency,
+        "qdrant": "server" if args.qdrant_url else "memory",
+        "tokenizer": tokenizer.name,
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} cpus",
+    }
+
+
+def compare(results: dict, baseline: dict):
+    """Log the throughput of each stage relative to a stored baseline"""
+    for type, stages in results.items():
+        for stage, metrics in stages.items():
+            base = baseline.get(type, {}).get(stage)
+            if not base or not base.get("chunks_per_second"):
+                continue
+            ratio = metrics["chunks_per_second"] / base["chunks_per_second"]
+            marker = "✅" if ratio >= 0.95 else "⚠️"
+            logging.info(f"{marker} {type}/{stage}: {ratio:.2f}x baseline throughput")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scale", type=int, default=1, help="corpus size multiplier")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds per embedding request"
+    )
+    parser.add_argument(
+        "--qdrant-url", help="local qdrant to use instead of an in-memory client"
+    )
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument(
+        "--baseline",
+        default=BENCH_BASELINE,
+        help="compare against this results file, written if there is none",
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("run") and baseline["run"] != run_info(args):
+            logging.warning(f"⚠️ {args.baseline} was measured with {baseline['run']}")
+        compare(results, baseline)
+    elif args.baseline and not args.save:
+        # the first run on this machine is what later ones are compared to
+        args.save = args.baseline
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump({"run": run_info(args), **results}, f, indent=2)
+        logging.info(f"✅ saved results to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
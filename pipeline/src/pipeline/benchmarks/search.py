@@ -0,0 +1,434 @@
+"""Filtered search benchmark for HNSW and quantization settings.
+
+Copies the points of the askcisco.com collection (or a synthetic stand-in)
+into a local Qdrant once per index configuration, then replays a query set
+with the version, product and outdated filters the chat endpoint builds
+(web/src/routes/api/chat/+server.ts). Every combination of m, ef_construct
+and scalar quantization is indexed and searched with each search time ef,
+and reports p50/p99 latency and recall@10 against an exact search.
+
+    rye run bench_search --source-url https://qdrant.example.com --limit 50000
+    rye run bench_search --queries data/bench/queries.jsonl --ef 32 64 128
+    rye run bench_search --synthetic 20000 --save data/bench/search.json
+
+Queries are json lines with a "text" (embedded with the configured
+embedding backend) or a "vector", and the "product" and "version" picked in
+the chat ui. Without a query file, queries are sampled from the points.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from pipeline import ingest
+from pipeline.benchmarks.ingest import percentile
+from pipeline.embeddings import new_embedding_backend
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+BENCH_COLLECTION_PREFIX = "bench-search"
+
+# what the chat ui offers, for synthetic points and sampled queries
+PRODUCTS = ["firepower", "ftd", "fmc", "ise", "umbrella", "duo", "workload"]
+VERSIONS = ["6.7", "7.0", "7.2", "7.3", "7.4"]
+SHAPES = ("default", "product", "version", "product+version")
+
+
+def chat_filter(
+    product: str | None = None, version: str | None = None
+) -> models.Filter:
+    """The filter the chat endpoint builds for a product and version"""
+    must: list = []
+    must_not: list = []
+    if version and version != "All Versions":
+        must.append(
+            models.Filter(
+                should=[
+                    models.FieldCondition(
+                        key="metadata.versions", match=models.MatchValue(value=version)
+                    ),
+                    models.FieldCondition(
+                        key="metadata.version", match=models.MatchValue(value=version)
+                    ),
+                    models.Filter(
+                        must=[
+                            models.IsEmptyCondition(
+                                is_empty=models.PayloadField(key="metadata.versions")
+                            ),
+                            models.IsEmptyCondition(
+                                is_empty=models.PayloadField(key="metadata.version")
+                            ),
+                        ]
+                    ),
+                ]
+            )
+        )
+    if product and product != "All Products":
+        must.append(
+            models.Filter(
+                should=[
+                    models.FieldCondition(
+                        key="metadata.products",
+                        match=models.MatchValue(value=product.lower()),
+                    ),
+                    models.FieldCondition(
+                        key="metadata.product",
+                        match=models.MatchValue(value=product.lower()),
+                    ),
+                ]
+            )
+        )
+    if (not product and not version) or (
+        product == "All Products" and version == "All Versions"
+    ):
+        must_not.append(
+            models.FieldCondition(
+                key="metadata.outdated", match=models.MatchValue(value=True)
+            )
+        )
+    return models.Filter(must=must, must_not=must_not)
+
+
+def filter_shape(query: dict) -> str:
+    product = query.get("product") not in (None, "All Products")
+    version = query.get("version") not in (None, "All Versions")
+    if product and version:
+        return "product+version"
+    return "product" if product else "version" if version else "default"
+
+
+def copy_points(client: QdrantClient, limit: int | None = None) -> list[dict]:
+    """Points of the collection with their vectors and payloads"""
+    points: list[dict] = []
+    offset = None
+    while limit is None or len(points) < limit:
+        batch, offset = client.scroll(
+            ingest.collection_name,
+            limit=256 if limit is None else min(256, limit - len(points)),
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        points.extend(
+            {"id": p.id, "vector": p.vector, "payload": p.payload} for p in batch
+        )
+        if offset is None:
+            break
+    return points
+
+
+def synthetic_points(count: int, dimension: int, seed: int = 0) -> list[dict]:
+    """Clustered unit vectors with chunk-like filter metadata.
+
+    Clusters stand in for topics, so neighbours are meaningful and recall
+    behaves more like it does on real embeddings than on uniform noise.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, count // 200), dimension))
+    vectors = centers[rng.integers(len(centers), size=count)]
+    vectors = vectors + rng.normal(scale=0.5, size=(count, dimension))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    r = random.Random(seed)
+    points = []
+    for i, vector in enumerate(vectors):
+        metadata: dict = {"source": f"https://www.cisco.com/synthetic/{i // 20}"}
+        if r.random() < 0.8:
+            metadata["products"] = r.sample(PRODUCTS, r.randint(1, 2))
+        if r.random() < 0.6:
+            metadata["versions"] = r.sample(VERSIONS, r.randint(1, 3))
+        if r.random() < 0.1:
+            metadata["outdated"] = True
+        points.append(
+            {"id": i, "vector": vector.tolist(), "payload": {"metadata": metadata}}
+        )
+    return points
+
+
+def load_queries(path: str) -> list[dict]:
+    with open(path, "r") as f:
+        queries = [json.loads(line) for line in f if line.strip()]
+    texts = [q for q in queries if "vector" not in q]
+    if texts:
+        embed = new_embedding_backend()
+        vectors = embed.embed_documents([q["text"] for q in texts])
+        for query, vector in zip(texts, vectors):
+            query["vector"] = vector
+    return queries
+
+
+def sample_queries(points: list[dict], count: int, seed: int = 0) -> list[dict]:
+    """Perturbed point vectors, filtered on the product and version of the
+    point so most filters match something, cycling through the filter shapes
+    """
+    r = random.Random(seed)
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in range(count):
+        point = r.choice(points)
+        metadata = point["payload"].get("metadata", {})
+        products = metadata.get("products") or [
+            metadata.get("product") or r.choice(PRODUCTS)
+        ]
+        versions = metadata.get("versions") or [
+            metadata.get("version") or r.choice(VERSIONS)
+        ]
+        shape = SHAPES[i % len(SHAPES)]
+        vector = np.asarray(point["vector"])
+        vector = vector + rng.normal(scale=0.5 / np.sqrt(len(vector)), size=len(vector))
+        queries.append(
+            {
+                "vector": vector.tolist(),
+                "product": r.choice(products) if "product" in shape else None,
+                "version": r.choice(versions) if "version" in shape else None,
+            }
+        )
+    return queries
+
+
+def create_bench_collection(
+    client: QdrantClient,
+    name: str,
+    points: list[dict],
+    m: int,
+    ef_construct: int,
+    quantization: bool,
+    payload_indexes: bool = True,
+    batch_size: int = 256,
+    local: bool = False,
+):
+    client.recreate_collection(
+        collection_name=name,
+        vectors_config=models.VectorParams(
+            size=len(points[0]["vector"]), distance=models.Distance.COSINE
+        ),
+        hnsw_config=models.HnswConfigDiff(m=m, ef_construct=ef_construct),
+        # build the hnsw graph however small the copy is
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=1),
+        quantization_config=models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8, quantile=0.99, always_ram=True
+            )
+        )
+        if quantization
+        else None,
+    )
+    if payload_indexes:
+        # the indexes the collection itself has, see ingest.create_collection
+        ingest.create_payload_indexes(
+            client, name, ingest.PAYLOAD_INDEXES[ingest.collection_name]
+        )
+    for i in range(0, len(points), batch_size):
+        client.upsert(
+            collection_name=name,
+            points=[
+                models.PointStruct(**point) for point in points[i : i + batch_size]
+            ],
+        )
+    if not local:
+        # the local client has no hnsw to wait for
+        ingest.wait_for_index(client, name, len(points), timeout=3600, interval=1)
+
+
+def search(
+    client: QdrantClient,
+    name: str,
+    queries: list[dict],
+    params: models.SearchParams,
+    top: int,
+) -> tuple[list[list], list[float]]:
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = client.search(
+            collection_name=name,
+            query_vector=query["vector"],
+            query_filter=chat_filter(query.get("product"), query.get("version")),
+            limit=top,
+            search_params=params,
+            with_payload=False,
+        )
+        latencies.append(time.perf_counter() - start)
+        results.append([hit.id for hit in hits])
+    return results, latencies
+
+
+def summarize(
+    queries: list[dict],
+    results: list[list],
+    truth: list[list],
+    latencies: list[float],
+) -> dict:
+    recalls = [
+        len(set(found) & set(expected)) / len(expected)
+        for found, expected in zip(results, truth)
+        if expected
+    ]
+    return {
+        "queries": len(queries),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "recall": sum(recalls) / len(recalls) if recalls else 0.0,
+    }
+
+
+def run(args) -> list[dict]:
+    client = QdrantClient(
+        location=":memory:" if args.qdrant_url == ":memory:" else None,
+        url=None if args.qdrant_url == ":memory:" else args.qdrant_url,
+    )
+
+    if args.synthetic:
+        points = synthetic_points(args.synthetic, args.dimension, args.seed)
+    else:
+        source = (
+            ingest.new_qdrant_client()
+            if not args.source_url
+            else QdrantClient(url=args.source_url, api_key=ingest.QDRANT_API_KEY)
+        )
+        points = copy_points(source, args.limit)
+    if not points:
+        raise SystemExit("no points to index")
+    logging.info(f"📦 indexing {len(points)} points")
+
+    queries = (
+        load_queries(args.queries)
+        if args.queries
+        else sample_queries(points, args.num_queries, args.seed)
+    )
+    shapes = {shape: [filter_shape(q) == shape for q in queries] for shape in SHAPES}
+
+    truth = None
+    rows = []
+    configs = itertools.product(args.m, args.ef_construct, args.quantization)
+    for m, ef_construct, quantization in configs:
+        name = f"{BENCH_COLLECTION_PREFIX}-m{m}-efc{ef_construct}-{quantization}"
+        start = time.perf_counter()
+        create_bench_collection(
+            client,
+            name,
+            points,
+            m,
+            ef_construct,
+            quantization == "int8",
+            payload_indexes=not args.no_payload_indexes,
+            local=args.qdrant_url == ":memory:",
+        )
+        indexed = time.perf_counter() - start
+        logging.info(f"⏱ indexed {name} in {indexed:.1f}s")
+
+        if truth is None:
+            # exact search on the original vectors, the same for every config
+            truth, _ = search(
+                client,
+                name,
+                queries,
+                models.SearchParams(
+                    exact=True,
+                    quantization=models.QuantizationSearchParams(ignore=True),
+                ),
+                args.top,
+            )
+
+        for ef in args.ef:
+            params = models.SearchParams(
+                hnsw_ef=ef,
+                quantization=models.QuantizationSearchParams(rescore=True)
+                if quantization == "int8"
+                else None,
+            )
+            # one untimed pass so every config is measured warm
+            search(client, name, queries[: args.top], params, args.top)
+            results, latencies = search(client, name, queries, params, args.top)
+
+            row = {
+                "m": m,
+                "ef_construct": ef_construct,
+                "quantization": quantization,
+                "ef": ef,
+                "index_seconds": indexed,
+                **summarize(queries, results, truth, latencies),
+                "shapes": {
+                    shape: summarize(
+                        *(
+                            [x for x, keep in zip(values, mask) if keep]
+                            for values in (queries, results, truth, latencies)
+                        )
+                    )
+                    for shape, mask in shapes.items()
+                    if any(mask)
+                },
+            }
+            rows.append(row)
+            logging.info(
+                f"⏱ m={m} ef_construct={ef_construct} quantization={quantization} "
+                f"ef={ef}: p50={row['p50_ms']:.1f}ms p99={row['p99_ms']:.1f}ms "
+                f"recall@{args.top}={row['recall']:.3f}"
+            )
+
+        if not args.keep:
+            client.delete_collection(name)
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--qdrant-url",
+        default="http://localhost:6333",
+        help="local qdrant the copies are indexed in (:memory: has no hnsw, "
+        "only for trying the benchmark out)",
+    )
+    parser.add_argument(
+        "--source-url",
+        help="qdrant to copy the collection from, defaults to QDRANT_URL",
+    )
+    parser.add_argument("--limit", type=int, help="copy at most this many points")
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        help="index this many synthetic points instead of copying the collection",
+    )
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", help="json lines query set")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--m", type=int, nargs="+", default=[16, 32])
+    parser.add_argument("--ef-construct", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--ef", type=int, nargs="+", default=[32, 64, 128, 256])
+    parser.add_argument(
+        "--quantization", nargs="+", choices=["none", "int8"], default=["none", "int8"]
+    )
+    parser.add_argument(
+        "--no-payload-indexes",
+        action="store_true",
+        help="index the copies without payload indexes, to measure what they save",
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the benchmark collections"
+    )
+    parser.add_argument("--save", help="write the results to this json file")
+    args = parser.parse_args()
+
+    rows = run(args)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(rows, f, indent=2)
+        logging.info(f"✅ saved results to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
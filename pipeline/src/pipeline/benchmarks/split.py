@@ -0,0 +1,79 @@
+"""Compare the token offset splitter against RecursiveCharacterTextSplitter.
+
+Runs both splitters over the scraped docs in data/queue/docs (and any extra
+text files passed as arguments) and reports time, chunk counts and chunk
+token sizes for each.
+
+    rye run bench_split [file.txt ...]
+"""
+import glob
+import json
+import logging
+import statistics
+import sys
+import time
+
+from langchain.schema import Document
+
+from pipeline.ingest import read_doc_sections
+from pipeline.tokens import recursive_text_splitter, text_splitter, tiktoken_lens
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+
+def load_corpus(paths: list[str]) -> list[Document]:
+    docs = []
+    for file_name in glob.glob("data/queue/docs/*.json*"):
+        for section in read_doc_sections(file_name):
+            if section.get("content"):
+                docs.append(
+                    Document(
+                        page_content=section["content"],
+                        metadata={"source": section.get("url", file_name)},
+                    )
+                )
+    for path in paths:
+        with open(path, "r") as f:
+            docs.append(Document(page_content=f.read(), metadata={"source": path}))
+    return docs
+
+
+def run(name: str, splitter, docs: list[Document]) -> dict:
+    start = time.perf_counter()
+    chunks = splitter.split_documents(docs)
+    elapsed = time.perf_counter() - start
+
+    lengths = tiktoken_lens([c.page_content for c in chunks]) or [0]
+    result = {
+        "splitter": name,
+        "seconds": round(elapsed, 3),
+        "chunks": len(chunks),
+        "mean_tokens": round(statistics.mean(lengths), 1),
+        "max_tokens": max(lengths),
+    }
+    logging.info(json.dumps(result))
+    return result
+
+
+def main():
+    docs = load_corpus(sys.argv[1:])
+    if not docs:
+        logging.error("no documents found - scrape some docs or pass text files")
+        return
+
+    total = sum(tiktoken_lens([d.page_content for d in docs]))
+    logging.info(f"benchmarking {len(docs)} documents ({total} tokens)")
+
+    recursive = run("recursive", recursive_text_splitter, docs)
+    token_offset = run("token_offset", text_splitter, docs)
+
+    logging.info(
+        f"⏱ token offset splitter is "
+        f"{recursive['seconds'] / max(token_offset['seconds'], 1e-9):.1f}x faster"
+    )
+
+
+if __name__ == "__main__":
+    main()
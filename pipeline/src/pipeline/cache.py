@@ -0,0 +1,130 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from array import array
+
+from pipeline.db import connect
+
+EMBEDDING_CACHE_PATH = (
+    os.getenv("EMBEDDING_CACHE_PATH") or "data/cache/embeddings.sqlite"
+)
+# roughly 6kb per ada-002 vector, so the default caps the cache at ~3gb
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES") or 500_000)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed on the model name and a hash of the text.
+
+    Entries are evicted least-recently-used first once ``max_entries`` is hit.
+    """
+
+    def __init__(
+        self,
+        path: str = EMBEDDING_CACHE_PATH,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        # shared by the embedding worker threads
+        self.lock = threading.RLock()
+        self.conn = connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return f"{model}:{content_hash(text)}"
+
+    def get_many(self, model: str, texts: list[str]) -> list[list[float] | None]:
+        """Look up every text, returning None for the ones that are not cached"""
+        keys = [self.key(model, t) for t in texts]
+        found: dict[str, list[float]] = {}
+
+        with self.lock:
+            # stay under sqlite's bound parameter limit
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+
+            if found:
+                now = time.time()
+                with self.conn:
+                    self.conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                        [(now, k) for k in found],
+                    )
+
+        vectors = [found.get(k) for k in keys]
+        hits = sum(1 for v in vectors if v is not None)
+        with self.lock:
+            self.hits += hits
+            self.misses += len(vectors) - hits
+        return vectors
+
+    def set_many(self, model: str, texts: list[str], vectors: list[list[float]]):
+        now = time.time()
+        rows = [
+            (self.key(model, t), array("f", v).tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    rows,
+                )
+            self._evict()
+
+    def evict(self):
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow <= 0:
+            return
+        with self.conn:
+            self.conn.execute(
+                """
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?
+                )
+                """,
+                (overflow,),
+            )
+        logging.info(f"🧹 evicted {overflow} cached embeddings")
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,12 @@
+import os
+import sqlite3
+
+
+def connect(path: str, **kwargs) -> sqlite3.Connection:
+    """Open an SQLite database shared by threads and other ingest workers"""
+    if path != ":memory:":
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # timeout covers other ingest workers writing at the same time
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30, **kwargs)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
@@ -0,0 +1,167 @@
+import os
+import threading
+import zlib
+from typing import Container
+
+import numpy as np
+
+from pipeline.db import connect
+
+# off, skip (near-duplicate chunks are dropped) or reference (they are stored
+# as their own point, reusing the vector of the chunk they duplicate)
+DEDUPE_POLICY = os.getenv("DEDUPE_POLICY") or "reference"
+DEDUPE_INDEX_PATH = os.getenv("DEDUPE_INDEX_PATH") or "data/cache/dedupe.sqlite"
+# estimated jaccard similarity of word shingles above which chunks are duplicates
+DEDUPE_THRESHOLD = float(os.getenv("DEDUPE_THRESHOLD") or 0.9)
+
+POLICIES = ("off", "skip", "reference")
+
+SHINGLE_WORDS = 5
+NUM_PERM = 64
+# 16 bands of 4 rows make chunks above ~0.5 similarity candidates, which are
+# then checked against the threshold on the full signature
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+_PRIME = np.uint64(4294967311)  # the first prime above 2**32
+_rng = np.random.RandomState(42)
+_A = _rng.randint(1, 2**32 - 1, NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, 2**32 - 1, NUM_PERM, dtype=np.uint64)
+
+# one indexed lookup per band, a row value IN (VALUES ...) makes sqlite scan
+# the whole bands table instead
+_FIND_CANDIDATES = f"""
+    SELECT point_id, signature FROM signatures WHERE point_id IN (
+        {" UNION ALL ".join(["SELECT point_id FROM bands WHERE band = ? AND key = ?"] * BANDS)}
+    )
+"""
+
+
+def minhash(text: str) -> np.ndarray | None:
+    """MinHash signature of the word shingles of a text"""
+    words = text.lower().split()
+    if not words:
+        return None
+    shingles = {
+        " ".join(words[i : i + SHINGLE_WORDS])
+        for i in range(max(1, len(words) - SHINGLE_WORDS + 1))
+    }
+    hashes = np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    # both factors are below 2**32, so the products fit in 64 bits
+    return ((np.outer(hashes, _A) + _B) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated jaccard similarity of the texts two signatures came from"""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+class DedupeIndex:
+    """Corpus-wide MinHash LSH index of ingested chunks, kept in SQLite.
+
+    Each chunk's signature is split into bands and a chunk with a band that
+    matches one already indexed is compared on the full signature. Chunks
+    that are not duplicates are indexed once written, so the first copy of
+    a page becomes the canonical point that later copies refer to.
+    """
+
+    def __init__(
+        self,
+        path: str = DEDUPE_INDEX_PATH,
+        policy: str = DEDUPE_POLICY,
+        threshold: float = DEDUPE_THRESHOLD,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown dedupe policy {policy}, use one of {POLICIES}")
+        self.policy = policy
+        self.threshold = threshold
+
+        self.lock = threading.Lock()
+        self.conn = connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS signatures (
+                point_id TEXT PRIMARY KEY,
+                signature BLOB NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bands (
+                band INTEGER NOT NULL,
+                key BLOB NOT NULL,
+                point_id TEXT NOT NULL
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS bands_key ON bands (band, key)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS bands_point ON bands (point_id)")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def find(
+        self, text: str, exclude: Container[str] = ()
+    ) -> tuple[str | None, np.ndarray | None]:
+        """The id of an indexed near-duplicate of a text that is not in
+        `exclude`, and the text's signature
+        """
+        signature = minhash(text)
+        if signature is None:
+            return None, None
+        with self.lock:
+            candidates = self.conn.execute(
+                _FIND_CANDIDATES,
+                [value for band in _bands(signature) for value in band],
+            ).fetchall()
+
+        best, best_similarity = None, self.threshold
+        for candidate, blob in candidates:
+            if candidate in exclude:
+                continue
+            s = similarity(signature, np.frombuffer(blob, dtype=np.uint32))
+            if s >= best_similarity:
+                best, best_similarity = candidate, s
+        return best, signature
+
+    def add(self, points: list[tuple[str, np.ndarray]]):
+        """Index points once they are written, as canonical copies of their text"""
+        with self.lock, self.conn:
+            # a chunk ingested again (e.g. a forced source) replaces itself
+            self.conn.executemany(
+                "DELETE FROM bands WHERE point_id = ?", [(id,) for id, _ in points]
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO signatures VALUES (?, ?)",
+                [(id, signature.tobytes()) for id, signature in points],
+            )
+            self.conn.executemany(
+                "INSERT INTO bands VALUES (?, ?, ?)",
+                [
+                    (band, key, id)
+                    for id, signature in points
+                    for band, key in _bands(signature)
+                ],
+            )
+
+    def remove(self, point_ids: list[str]):
+        """Forget points that were deleted from the collection"""
+        with self.lock, self.conn:
+            for table in ("signatures", "bands"):
+                self.conn.executemany(
+                    f"DELETE FROM {table} WHERE point_id = ?",
+                    [(id,) for id in point_ids],
+                )
+
+
+def _bands(signature: np.ndarray) -> list[tuple[int, bytes]]:
+    return [
+        (band, signature[band * ROWS : (band + 1) * ROWS].tobytes())
+        for band in range(BANDS)
+    ]
@@ -0,0 +1,342 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import numpy as np
+from langchain.embeddings.openai import OpenAIEmbeddings
+from openai.error import (
+    APIConnectionError,
+    APIError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+)
+
+from pipeline.cache import EmbeddingCache
+from pipeline.metrics import metrics
+from pipeline.tokens import tiktoken_lens
+
+# openai, local (a sentence-transformers model on this machine's cpu) or
+# hashing (deterministic vectors for tests and benchmarks)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND") or "openai"
+# the openai model, or the path of the local model
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL") or "text-embedding-ada-002"
+# only used by the hashing backend, the others know their dimension
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION") or 1536)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS") or os.cpu_count() or 1)
+EMBEDDING_LOCAL_BATCH_SIZE = int(os.getenv("EMBEDDING_LOCAL_BATCH_SIZE") or 32)
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY") or 4)
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES") or 6)
+# defaults match the openai tier 1 limits for text-embedding-ada-002
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE") or 3000)
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE") or 1_000_000)
+
+RETRYABLE_ERRORS = (
+    APIConnectionError,
+    APIError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+)
+
+OPENAI_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+}
+
+
+class EmbeddingBackend:
+    """Turns batches of texts into vectors.
+
+    `model` names the vectors (it keys the embedding cache, so two backends
+    never share vectors) and `dimension` is their size. Only remote apis are
+    rate limited.
+    """
+
+    model: str
+    dimension: int
+    rate_limited = False
+
+    @classmethod
+    def describe(cls) -> tuple[str, int]:
+        """The model and dimension of the configured backend, without loading it"""
+        raise NotImplementedError
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    rate_limited = True
+
+    @classmethod
+    def describe(cls, model: str = EMBEDDING_MODEL) -> tuple[str, int]:
+        if model not in OPENAI_DIMENSIONS:
+            raise ValueError(f"unknown openai embedding model {model}")
+        return model, OPENAI_DIMENSIONS[model]
+
+    def __init__(self, model: str = EMBEDDING_MODEL):
+        self.model, self.dimension = self.describe(model)
+        # batches run concurrently so per-call progress bars would interleave,
+        # and embed_with_retry does the retrying, a single attempt each call
+        # keeps it going through the rate limiter
+        self.embeddings = OpenAIEmbeddings(
+            client=None, model=model, show_progress_bar=False, max_retries=1
+        )
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+
+class LocalEmbeddingBackend(EmbeddingBackend):
+    """A sentence-transformers model loaded from a local path, run on the cpu.
+
+    Texts are encoded in batches of `batch_size` with torch using `threads`
+    cores. One batch is encoded at a time, concurrent batches would only
+    compete for the same cores.
+    """
+
+    @classmethod
+    def describe(cls, path: str = EMBEDDING_MODEL) -> tuple[str, int]:
+        dimension = local_model_dimension(path)
+        if dimension is None:
+            # a layout the config doesn't tell, load the model to find out
+            backend = cls(path)
+            return backend.model, backend.dimension
+        return cls.model_name(path), dimension
+
+    @staticmethod
+    def model_name(path: str) -> str:
+        return f"local:{os.path.basename(os.path.normpath(path))}"
+
+    def __init__(
+        self,
+        path: str = EMBEDDING_MODEL,
+        threads: int = EMBEDDING_THREADS,
+        batch_size: int = EMBEDDING_LOCAL_BATCH_SIZE,
+    ):
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "the local embedding backend needs sentence-transformers, "
+                "install the pipeline with the local extra"
+            ) from e
+
+        torch.set_num_threads(threads)
+        self.model = self.model_name(path)
+        self.encoder = SentenceTransformer(path, device="cpu")
+        self.dimension = self.encoder.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        with self.lock:
+            vectors = self.encoder.encode(
+                texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            )
+        return vectors.tolist()
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """Deterministic vectors derived from a hash of each text.
+
+    Equal texts get equal vectors and nothing else is similar, which is all
+    tests and benchmarks of the pipeline itself need.
+    """
+
+    @classmethod
+    def describe(cls, dimension: int = EMBEDDING_DIMENSION) -> tuple[str, int]:
+        return f"hashing-{dimension}", dimension
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION):
+        self.model, self.dimension = self.describe(dimension)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.vector(t) for t in texts]
+
+    def vector(self, text: str) -> list[float]:
+        seed = hashlib.sha256(text.encode("utf-8")).digest()
+        rng = np.random.default_rng(int.from_bytes(seed[:8], "little"))
+        vector = rng.uniform(-1, 1, self.dimension)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+
+EMBEDDING_BACKENDS = {
+    "openai": OpenAIEmbeddingBackend,
+    "local": LocalEmbeddingBackend,
+    "hashing": HashingEmbeddingBackend,
+}
+
+
+def local_model_dimension(path: str) -> int | None:
+    """Output size of a saved sentence-transformers model, read from its config"""
+    try:
+        with open(os.path.join(path, "modules.json"), "r") as f:
+            modules = json.load(f)
+        # the last module that changes the size decides it
+        for module in reversed(modules):
+            kind = module["type"].rsplit(".", 1)[-1]
+            if kind not in ("Dense", "Pooling"):
+                continue
+            with open(os.path.join(path, module["path"], "config.json"), "r") as f:
+                config = json.load(f)
+            if kind == "Dense":
+                return config["out_features"]
+            # each enabled pooling mode adds a vector of the word embedding size
+            modes = [
+                k for k, v in config.items() if k.startswith("pooling_mode_") and v
+            ]
+            return config["word_embedding_dimension"] * max(len(modes), 1)
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+
+def _backend(name: str) -> type[EmbeddingBackend]:
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(
+            f"unknown embedding backend {name}, use one of {tuple(EMBEDDING_BACKENDS)}"
+        )
+    return EMBEDDING_BACKENDS[name]
+
+
+def new_embedding_backend(name: str = EMBEDDING_BACKEND) -> EmbeddingBackend:
+    return _backend(name)()
+
+
+def embedding_model(name: str = EMBEDDING_BACKEND) -> tuple[str, int]:
+    """The model and dimension of a backend, without creating its client or
+    loading its model
+    """
+    return _backend(name).describe()
+
+
+class RateLimiter:
+    """Token bucket limiter for both requests per minute and tokens per minute.
+
+    Buckets start full and refill continuously, so short bursts are allowed
+    as long as the average rate stays under the limits.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = EMBEDDING_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = EMBEDDING_TOKENS_PER_MINUTE,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests = float(requests_per_minute)
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(
+            self.requests_per_minute,
+            self.requests + elapsed * self.requests_per_minute / 60,
+        )
+        self.tokens = min(
+            self.tokens_per_minute,
+            self.tokens + elapsed * self.tokens_per_minute / 60,
+        )
+
+    def acquire(self, tokens: int = 0):
+        """Block until one request using `tokens` tokens is allowed"""
+        # a single request larger than the bucket could never be admitted
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.requests >= 1 and self.tokens >= tokens:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self.requests) * 60 / self.requests_per_minute,
+                    (tokens - self.tokens) * 60 / self.tokens_per_minute,
+                )
+            time.sleep(wait)
+
+
+def backoff(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def embed_with_retry(
+    embed: EmbeddingBackend,
+    texts: list[str],
+    limiter: RateLimiter | None = None,
+    tokens: int | None = None,
+    max_retries: int = EMBEDDING_MAX_RETRIES,
+) -> list[list[float]]:
+    if tokens is None:
+        tokens = sum(tiktoken_lens(texts))
+    attempt = 0
+    while True:
+        if limiter:
+            with metrics.timer("embed.rate_limit"):
+                limiter.acquire(tokens)
+        try:
+            metrics.count("embed", "api_calls")
+            with metrics.timer("embed"):
+                vectors = embed.embed_documents(texts)
+            metrics.count("embed", "texts", len(texts))
+            metrics.count("embed", "tokens", tokens)
+            return vectors
+        except RETRYABLE_ERRORS as e:
+            if attempt >= max_retries:
+                metrics.count("embed", "failures")
+                raise
+            metrics.count("embed", "retries")
+            delay = backoff(attempt)
+            attempt += 1
+            logging.warning(
+                f"⚠️ embedding error ({e.__class__.__name__}) - "
+                f"retrying in {delay:.1f}s ({attempt}/{max_retries})"
+            )
+            time.sleep(delay)
+
+
+def embed_cached(
+    embed: EmbeddingBackend,
+    texts: list[str],
+    cache: EmbeddingCache | None = None,
+    limiter: RateLimiter | None = None,
+    tokens: int | None = None,
+) -> list[list[float]]:
+    """Embed one batch, only sending the texts missing from the cache to the backend"""
+    if cache:
+        vectors = cache.get_many(embed.model, texts)
+    else:
+        vectors = [None] * len(texts)
+
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if cache:
+        metrics.count("embed", "cache_hits", len(texts) - len(missing))
+    if not missing:
+        return vectors
+
+    missing_texts = [texts[i] for i in missing]
+    if len(missing) < len(texts):
+        # the batch token count no longer applies, count the misses instead
+        tokens = None
+    new_vectors = embed_with_retry(embed, missing_texts, limiter, tokens=tokens)
+
+    if cache:
+        cache.set_many(embed.model, missing_texts, new_vectors)
+    for i, vector in zip(missing, new_vectors):
+        vectors[i] = vector
+    return vectors
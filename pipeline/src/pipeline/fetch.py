@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pipeline.db import connect
+
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR") or "data/cache/pdfs"
+PDF_FETCH_CONCURRENCY = int(os.getenv("PDF_FETCH_CONCURRENCY") or 8)
+PDF_FETCH_TIMEOUT = int(os.getenv("PDF_FETCH_TIMEOUT") or 120)
+
+
+class PDFFetcher:
+    """Download pdfs into a content-addressed on-disk cache.
+
+    Files are stored as ``blobs/<sha256>.pdf`` and an index maps each url to
+    its blob along with the ETag and Last-Modified headers it was served
+    with. Known urls are revalidated with a conditional request, so an
+    unchanged pdf costs a 304 rather than a download. Downloads share one
+    pooled session and run at most `concurrency` at a time.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = PDF_CACHE_DIR,
+        concurrency: int = PDF_FETCH_CONCURRENCY,
+        timeout: int = PDF_FETCH_TIMEOUT,
+    ):
+        self.cache_dir = cache_dir
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.timeout = timeout
+        self.downloaded = 0
+        self.revalidated = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.prefetched: dict[str, Future] = {}
+
+        self.lock = threading.Lock()
+        self.conn = connect(os.path.join(cache_dir, "index.sqlite"))
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pdfs (
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # prefetches still running write to the index, so they finish first
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.session.close()
+        self.conn.close()
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blob_dir, f"{sha256}.pdf")
+
+    def prefetch(self, urls: list[str]):
+        """Start fetching urls in the background"""
+        for url in urls:
+            if url not in self.prefetched:
+                self.prefetched[url] = self.executor.submit(self._fetch, url)
+
+    def fetch(self, url: str) -> str:
+        """Get the local path of a pdf, downloading it only if it changed"""
+        future = self.prefetched.pop(url, None)
+        if future is None:
+            future = self.executor.submit(self._fetch, url)
+        return future.result()
+
+    def _fetch(self, url: str) -> str:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT sha256, etag, last_modified FROM pdfs WHERE url = ?", (url,)
+            ).fetchone()
+
+        headers = {}
+        if row and os.path.exists(self.blob_path(row[0])):
+            sha256, etag, last_modified = row
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        else:
+            row = None
+
+        with self.session.get(
+            url, headers=headers, stream=True, timeout=self.timeout
+        ) as response:
+            if row and response.status_code == 304:
+                with self.lock:
+                    self.revalidated += 1
+                logging.info(f"📎 {url} unchanged")
+                return self.blob_path(row[0])
+            response.raise_for_status()
+
+            digest = hashlib.sha256()
+            fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for block in response.iter_content(chunk_size=1 << 16):
+                        digest.update(block)
+                        f.write(block)
+                sha256 = digest.hexdigest()
+                os.replace(tmp_path, self.blob_path(sha256))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO pdfs VALUES (?, ?, ?, ?, ?)",
+                    (url, sha256, etag, last_modified, time.time()),
+                )
+            self.downloaded += 1
+
+        logging.info(f"📥 downloaded {url}")
+        return self.blob_path(sha256)
@@ -1,29 +1,56 @@
+import argparse
+import functools
 import json
 import logging
+import multiprocessing
 import os
-import sys
+import re
 import time
-from uuid import uuid4
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator
+from urllib.parse import urlsplit, urlunsplit
+from uuid import NAMESPACE_URL, uuid5
 
 from langchain.document_loaders import (
     PlaywrightURLLoader,
     OnlinePDFLoader,
+    UnstructuredPDFLoader,
 )
-from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.schema import Document
-from openai.error import APIError
 from pydantic.parse import load_file
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 from qdrant_client.models import (
     FieldCondition,
     Filter,
-    FilterSelector,
+    HasIdCondition,
     MatchText,
+    MatchValue,
     PointStruct,
 )
 
-from pipeline.tokens import text_splitter
+from pipeline.cache import EmbeddingCache, content_hash
+from pipeline.dedupe import DEDUPE_POLICY, DedupeIndex
+from pipeline.embeddings import (
+    EMBEDDING_CONCURRENCY,
+    EMBEDDING_REQUESTS_PER_MINUTE,
+    EMBEDDING_TOKENS_PER_MINUTE,
+    OPENAI_DIMENSIONS,
+    EmbeddingBackend,
+    RateLimiter,
+    embed_cached,
+    embedding_model,
+    new_embedding_backend,
+)
+from pipeline.fetch import PDFFetcher
+from pipeline.metrics import current_source, metrics
+from pipeline.render import BrowserPool
+from pipeline.snapshot import VECTOR_SNAPSHOT, VectorSnapshot
+from pipeline.stream import ordered_map, prefetch
+from pipeline.tokens import batch_by_tokens, text_splitter, tiktoken_len
+from pipeline.upload import Uploader
+from pipeline.workqueue import QUEUE_DB_PATH, WorkQueue
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -32,158 +59,1017 @@ logging.basicConfig(
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") or "OPENAI_API_KEY"
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY") or "QDRANT_API_KEY"
 QDRANT_URL = os.getenv("QDRANT_URL") or "QDRANT_URL"
-model_name = "text-embedding-ada-002"
+# aliases of the live generation of each collection, rebuilds load a new
+# generation (askcisco.com-<timestamp>) and then switch the aliases over
 collection_name = "askcisco.com"
+# document level metadata, stored once per loaded document rather than on
+# every chunk and joined to search results by metadata.doc_id
+documents_collection_name = f"{collection_name}-documents"
+
+# the only metadata kept on chunk points, the fields searches filter on
+PAYLOAD_FIELDS = (
+    "source",
+    "queue_source",
+    "doc_id",
+    "versions",
+    "version",
+    "products",
+    "product",
+    "outdated",
+    "canonical_id",
+)
+DOCUMENT_BATCH_SIZE = 64
+
+# a point of each documents collection records the embedding model of the
+# vectors next to it, the chat route embeds questions with that model and
+# refuses to search a collection of a model it has no api for
+EMBEDDING_POINT_ID = str(uuid5(NAMESPACE_URL, f"{collection_name}#embedding"))
+# collections from before the model was recorded were all embedded with it
+LEGACY_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+GENERATION_FORMAT = "%Y%m%dT%H%M%S"
+GENERATION_PATTERN = re.compile(
+    rf"^{re.escape(collection_name)}-(\d{{8}}T\d{{6}})(-documents)?$"
+)
+
+# payload indexes of the fields the chat endpoint and ingest filter on
+PAYLOAD_INDEXES = {
+    collection_name: {
+        "metadata.source": models.PayloadSchemaType.KEYWORD,
+        "metadata.queue_source": models.PayloadSchemaType.KEYWORD,
+        "metadata.versions": models.PayloadSchemaType.KEYWORD,
+        "metadata.version": models.PayloadSchemaType.KEYWORD,
+        "metadata.products": models.PayloadSchemaType.KEYWORD,
+        "metadata.product": models.PayloadSchemaType.KEYWORD,
+        "metadata.outdated": models.PayloadSchemaType.BOOL,
+    },
+    documents_collection_name: {
+        "queue_source": models.PayloadSchemaType.KEYWORD,
+    },
+}
+
+INGEST_TYPES = ("docs", "pdfs", "urls")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS") or 1)
+# sources a worker claims ahead of the one it is ingesting, to render or
+# download them in the meantime
+INGEST_PREFETCH = int(os.getenv("INGEST_PREFETCH") or 8)
 
 
 def main():
-    qdrant_client = QdrantClient(
-        url=QDRANT_URL, api_key=QDRANT_API_KEY, prefer_grpc=True
+    parser = argparse.ArgumentParser(description="Embed queued sources into Qdrant")
+    parser.add_argument(
+        "--force", action="store_true", help="ingest every queued source again"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=INGEST_WORKERS,
+        help="number of worker processes taking sources off the queue",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="i/N, only ingest the i-th of N shards of the queue (e.g. one per machine)",
+    )
+    args = parser.parse_args()
+
+    client = new_qdrant_client()
+    create_collection(client)
+
+    # the json files are where sources get queued, progress is tracked in the
+    # work queue so an interrupted run picks up where it stopped
+    queue = WorkQueue()
+    for type in INGEST_TYPES:
+        entries = get_queued_data(type)
+        if type == "docs":
+            entries = mark_changed_docs(entries)
+        queue.import_json(type, entries)
+        if args.force:
+            queue.reset(type)
+    queue.requeue()
+
+    sources = get_ingested_sources(client)
+
+    # the embedding rate limits are per account, so every worker on every
+    # shard gets an equal part of them
+    shards = args.shard[1] if args.shard else 1
+    share = 1 / (args.workers * shards)
+
+    if args.workers > 1:
+        logging.info(f"👷 starting {args.workers} ingest workers")
+        # spawn rather than fork, the parent already has open grpc channels
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(args.workers, mp_context=context) as executor:
+            futures = [
+                executor.submit(run_worker, sources, args.shard, share, f"w{i}")
+                for i in range(args.workers)
+            ]
+            for future in futures:
+                future.result()
+    else:
+        run_worker(sources, args.shard, share)
+
+    for type in INGEST_TYPES:
+        counts = queue.counts(type)
+        if counts.get("failed"):
+            logging.warning(f"⚠️ {counts['failed']} {type} failed, see {QUEUE_DB_PATH}")
+    queue.close()
+
+
+def run_worker(
+    sources: set[str],
+    shard: tuple[int, int] | None = None,
+    share: float = 1,
+    name: str | None = None,
+):
+    """Ingest queued sources until the queue is empty.
+
+    Each worker has its own clients, caches and `share` of the embedding
+    rate limits, and claims sources from the shared work queue, so any
+    number of them can run side by side.
+    """
+    client = new_qdrant_client()
+    embed = new_embedding_backend()
+    cache = EmbeddingCache()
+    limiter = None
+    if embed.rate_limited:
+        limiter = RateLimiter(
+            EMBEDDING_REQUESTS_PER_MINUTE * share, EMBEDDING_TOKENS_PER_MINUTE * share
+        )
+    queue = WorkQueue()
+    dedupe = DedupeIndex() if DEDUPE_POLICY != "off" else None
+    snapshot = VectorSnapshot() if VECTOR_SNAPSHOT else None
+    uploader = Uploader(client, collection_name)
+
+    ingest(
+        client,
+        embed,
+        "docs",
+        cache=cache,
+        sources=sources,
+        limiter=limiter,
+        queue=queue,
+        shard=shard,
+        dedupe=dedupe,
+        snapshot=snapshot,
+        uploader=uploader,
+    )
+
+    # pdfs are downloaded into a local cache and only refetched when changed
+    with PDFFetcher() as fetcher:
+        ingest(
+            client,
+            embed,
+            "pdfs",
+            cache=cache,
+            sources=sources,
+            limiter=limiter,
+            fetcher=fetcher,
+            queue=queue,
+            shard=shard,
+            dedupe=dedupe,
+            snapshot=snapshot,
+            uploader=uploader,
+        )
+
+    # one browser renders every queued url
+    with BrowserPool() as pool:
+        ingest(
+            client,
+            embed,
+            "urls",
+            cache=cache,
+            sources=sources,
+            limiter=limiter,
+            pool=pool,
+            queue=queue,
+            shard=shard,
+            dedupe=dedupe,
+            snapshot=snapshot,
+            uploader=uploader,
+        )
+
+    logging.info(
+        f"📦 embedding cache hit ratio {cache.hit_ratio:.1%} "
+        f"({cache.hits} hits, {cache.misses} misses)"
+    )
+    cache.close()
+    queue.close()
+    uploader.close()
+
+    if dedupe:
+        saved = metrics.report()["stages"].get("dedupe", {})
+        logging.info(
+            f"♊ near-duplicates saved {saved.get('embeddings_saved', 0):.0f} "
+            f"embeddings and {saved.get('points_saved', 0):.0f} points"
+        )
+        dedupe.close()
+    if snapshot:
+        snapshot.close()
+
+    metrics.write(name=name)
+
+
+def new_qdrant_client() -> QdrantClient:
+    return QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY, prefer_grpc=True)
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    try:
+        index, count = (int(v) for v in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard {index} is not in 0..{count - 1}")
+    return index, count
+
+
+def ingest(
+    client: QdrantClient,
+    embed: EmbeddingBackend,
+    type: str,
+    force=False,
+    cache: EmbeddingCache | None = None,
+    sources: set[str] | None = None,
+    limiter: RateLimiter | None = None,
+    pool: BrowserPool | None = None,
+    fetcher: PDFFetcher | None = None,
+    queue: WorkQueue | None = None,
+    shard: tuple[int, int] | None = None,
+    dedupe: DedupeIndex | None = None,
+    snapshot: VectorSnapshot | None = None,
+    uploader: Uploader | None = None,
+):
+    if queue is None:
+        queue = WorkQueue()
+        queue.import_json(type, get_queued_data(type))
+        queue.requeue()
+    if force:
+        queue.reset(type)
+    if sources is None:
+        sources = get_ingested_sources(client)
+    if limiter is None and embed.rate_limited:
+        limiter = RateLimiter()
+
+    def start_loading(item: dict):
+        # render pages or download pdfs while earlier sources embed, only
+        # ones this worker claimed so no other worker loads them as well
+        if should_ingest(item, sources):
+            if pool:
+                pool.prefetch([item["source"]])
+            if fetcher:
+                fetcher.prefetch([item["source"]])
+
+    ahead = INGEST_PREFETCH if pool or fetcher else 0
+    for item in claim_ahead(queue, type, shard, ahead, start_loading):
+        source = item["source"]
+        exists = normalize_source(source) in sources
+
+        if not should_ingest(item, sources):
+            logging.info(f"⤵️ skipping {source} - already exists")
+            if pool:
+                pool.discard(source)
+            queue.complete(item["id"])
+            continue
+        if item["force"]:
+            logging.info(f"‼️ force adding {source}")
+
+        try:
+            stats = ingest_item(
+                client,
+                embed,
+                type,
+                item,
+                exists,
+                cache=cache,
+                limiter=limiter,
+                pool=pool,
+                fetcher=fetcher,
+                queue=queue,
+                dedupe=dedupe,
+                snapshot=snapshot,
+                uploader=uploader,
+            )
+        except Exception as e:
+            logging.exception(f"❌ failed to ingest {source}")
+            # a page it failed before rendering would keep its prefetch slot
+            if pool:
+                pool.discard(source)
+            queue.fail(item["id"], repr(e))
+            continue
+        if not stats["chunks"]:
+            # nothing loaded (e.g. the page did not render), retried next run
+            logging.info(f"⤵️ skipping {source} - no documents")
+            queue.fail(item["id"], "no documents")
+            continue
+
+        sources.add(normalize_source(source))
+        queue.complete(item["id"])
+
+
+def claim_ahead(
+    queue: WorkQueue,
+    type: str,
+    shard: tuple[int, int] | None,
+    ahead: int,
+    on_claim: Callable[[dict], None],
+) -> Iterator[dict]:
+    """Claim items in queue order, keeping up to `ahead` more claimed than the
+    one being ingested. A worker that dies leaves them to be requeued.
+    """
+    claimed: deque[dict] = deque()
+    while True:
+        while len(claimed) <= ahead:
+            item = queue.claim(type, shard)
+            if item is None:
+                break
+            on_claim(item)
+            claimed.append(item)
+        if not claimed:
+            return
+        yield claimed.popleft()
+
+
+def ingest_item(
+    client: QdrantClient,
+    embed: EmbeddingBackend,
+    type: str,
+    item: dict,
+    exists: bool,
+    cache: EmbeddingCache | None = None,
+    limiter: RateLimiter | None = None,
+    pool: BrowserPool | None = None,
+    fetcher: PDFFetcher | None = None,
+    queue: WorkQueue | None = None,
+    dedupe: DedupeIndex | None = None,
+    snapshot: VectorSnapshot | None = None,
+    uploader: Uploader | None = None,
+) -> dict:
+    source = item["source"]
+    # the loaders add their own keys to the metadata, keep the queue entry as is
+    data = {k: v for k, v in item["data"].items() if k not in ("force", "update")}
+
+    checkpoint = queue.checkpoint(item["id"]) if queue else None
+    if checkpoint:
+        # the last run stopped part way through this source, the points it
+        # committed count as existing so they are not embedded again
+        existing_ids, committed = checkpoint
+        existing_ids |= committed
+        logging.info(f"♻️ resuming {source} after {len(committed)} committed chunks")
+    else:
+        with metrics.timer("existing_ids"):
+            # legacy docs points carry their chapter urls, not the queued toc,
+            # so a source can look new and still have points to replace
+            if exists or has_legacy_points(client):
+                existing_ids = get_source_point_ids(client, source)
+            else:
+                existing_ids = set()
+        if queue:
+            queue.start_checkpoint(item["id"], existing_ids)
+    hits = cache.hits if cache else 0
+
+    stats = ingest_source(
+        client,
+        embed,
+        source,
+        load_documents(type, data, pool=pool, fetcher=fetcher),
+        existing_ids,
+        cache=cache,
+        limiter=limiter,
+        on_commit=(lambda ids: queue.commit_batch(item["id"], ids)) if queue else None,
+        dedupe=dedupe,
+        snapshot=snapshot,
+        uploader=uploader,
+    )
+
+    if not stats["chunks"]:
+        return stats
+
+    if cache:
+        logging.info(
+            f"📦 {cache.hits - hits}/{stats['chunks'] - stats['unchanged']} "
+            f"embeddings found in cache"
+        )
+    logging.info(
+        f"🧠 {source}: {stats['added']} new {type} embeddings, "
+        f"{stats['unchanged']} unchanged, {stats['removed']} removed"
     )
-    embed = OpenAIEmbeddings(client=None, model=model_name, show_progress_bar=True)
+    if stats["duplicates"]:
+        logging.info(f"♊ {stats['duplicates']} near-duplicate chunks in {source}")
+    return stats
 
-    create_collection(qdrant_client)
 
-    # check if --force flag is passed
-    force = False
-    if len(sys.argv) > 1 and sys.argv[1] == "--force":
-        force = True
+def should_ingest(item: dict, sources: set[str]) -> bool:
+    if item["force"] or item["resume"]:
+        return True
+    return normalize_source(item["source"]) not in sources
 
-    ingest(qdrant_client, embed, "docs", force=force)
-    ingest(qdrant_client, embed, "pdfs", force=force)
-    ingest(qdrant_client, embed, "urls", force=force)
 
+def load_documents(
+    type: str,
+    data: dict,
+    pool: BrowserPool | None = None,
+    fetcher: PDFFetcher | None = None,
+) -> Iterator[Document]:
+    if type == "urls":
+        return iter_documents_from_queued_urls([data], pool)
+    elif type == "docs":
+        return iter_documents_from_queued_docs([data])
+    elif type == "pdfs":
+        return iter_docs_from_queued_pdfs([data], fetcher)
+    else:
+        raise Exception("unknown type")
 
-def ingest(client: QdrantClient, embed: OpenAIEmbeddings, type: str, force=False):
-    datas = get_queued_data(type)
 
-    for data in datas:
-        # check if "force" or "update" is a key in the data
-        document_force = False
-        if data.get("force") or data.get("update"):
-            document_force = True
+def ingest_source(
+    client: QdrantClient,
+    embed: EmbeddingBackend,
+    source: str,
+    documents: Iterable[Document],
+    existing_ids: set[str],
+    cache: EmbeddingCache | None = None,
+    limiter: RateLimiter | None = None,
+    on_commit: Callable[[list[str]], None] | None = None,
+    dedupe: DedupeIndex | None = None,
+    snapshot: VectorSnapshot | None = None,
+    uploader: Uploader | None = None,
+) -> dict:
+    """Stream one source through split -> embed -> upsert with bounded buffers.
 
-        if not force and not document_force:
-            results, _ = client.scroll(
+    Loading runs ahead in its own thread, up to EMBEDDING_CONCURRENCY batches
+    are embedded at once and upserts run in the background while the next
+    batches are embedded, so only a few batches are ever held in memory.
+    Only chunks with a new id (new position or changed content) are embedded
+    and written, and ids that are no longer produced are removed at the end.
+    `on_commit` is called with the ids of each batch once Qdrant has it.
+    Chunks that `dedupe` finds a near-duplicate of are skipped or reuse the
+    duplicate's vector, depending on its policy. Everything written to (and
+    removed from) Qdrant is mirrored to `snapshot`. Points go through
+    `uploader` (one of its own if not given) in chunked parallel requests.
+    """
+    token = current_source.set(source)
+    own_uploader = uploader is None
+    if own_uploader:
+        uploader = Uploader(client, collection_name)
+    try:
+        return _ingest_source(
+            client,
+            embed,
+            source,
+            documents,
+            existing_ids,
+            cache,
+            limiter,
+            on_commit,
+            dedupe,
+            snapshot,
+            uploader,
+        )
+    finally:
+        if own_uploader:
+            uploader.close()
+        current_source.reset(token)
+
+
+def _ingest_source(
+    client: QdrantClient,
+    embed: EmbeddingBackend,
+    source: str,
+    documents: Iterable[Document],
+    existing_ids: set[str],
+    cache: EmbeddingCache | None,
+    limiter: RateLimiter | None,
+    on_commit: Callable[[list[str]], None] | None,
+    dedupe: DedupeIndex | None,
+    snapshot: VectorSnapshot | None,
+    uploader: Uploader,
+) -> dict:
+    ids: set[str] = set()
+    doc_ids: set[str] = set()
+    stats = {"chunks": 0, "unchanged": 0, "added": 0, "removed": 0, "duplicates": 0}
+    # minhash signatures of new canonical chunks, indexed once they are upserted
+    signatures = {}
+
+    def new_chunks():
+        doc_points: list[PointStruct] = []
+        for doc in prefetch(documents):
+            doc_id = document_id(source, doc)
+            if doc_id not in doc_ids:
+                doc_ids.add(doc_id)
+                doc_points.append(document_point(doc_id, source, doc))
+            if len(doc_points) >= DOCUMENT_BATCH_SIZE:
+                upsert_documents(client, doc_points, snapshot)
+                doc_points = []
+
+            for chunk in text_splitter.split_documents([doc]):
+                chunk.metadata["queue_source"] = source
+                chunk.metadata["doc_id"] = doc_id
+                id = point_id(source, stats["chunks"], chunk.page_content)
+                stats["chunks"] += 1
+                ids.add(id)
+                if id in existing_ids:
+                    stats["unchanged"] += 1
+                    continue
+
+                canonical = None
+                if dedupe:
+                    # the source's own points may be deleted as stale at the
+                    # end of this pass, so they can't be the canonical copy
+                    with metrics.timer("dedupe"):
+                        canonical, signature = dedupe.find(
+                            chunk.page_content, exclude=existing_ids
+                        )
+                    if canonical == id:
+                        canonical = None
+                    if canonical is None and signature is not None:
+                        signatures[id] = signature
+                if canonical:
+                    stats["duplicates"] += 1
+                    metrics.count("dedupe", "duplicates")
+                    if dedupe.policy == "skip":
+                        metrics.count("dedupe", "embeddings_saved")
+                        metrics.count("dedupe", "points_saved")
+                        continue
+                    chunk.metadata["canonical_id"] = canonical
+
+                yield id, chunk, tiktoken_len(chunk.page_content), canonical
+
+        if doc_points:
+            upsert_documents(client, doc_points, snapshot)
+
+    def embed_batch(batch):
+        # near-duplicates reuse the vector of their canonical point, the rest
+        # (and any whose canonical is not written yet) are embedded
+        vectors = canonical_vectors(client, [c for *_, c in batch if c])
+        missing = [item for item in batch if item[3] not in vectors]
+        if len(missing) < len(batch):
+            metrics.count("dedupe", "embeddings_saved", len(batch) - len(missing))
+        embedded = iter(
+            embed_cached(
+                embed,
+                [chunk.page_content for _, chunk, *_ in missing],
+                cache,
+                limiter,
+                tokens=sum(tokens for _, _, tokens, _ in missing),
+            )
+            if missing
+            else []
+        )
+        return [vectors[c] if c in vectors else next(embedded) for *_, c in batch]
+
+    def upsert_batch(points: list[PointStruct]):
+        uploader.upload(points)
+        if snapshot:
+            with metrics.timer("snapshot"):
+                snapshot.add(collection_name, points)
+        if dedupe:
+            dedupe.add(
+                [(p.id, signatures.pop(p.id)) for p in points if p.id in signatures]
+            )
+        if on_commit:
+            on_commit([point.id for point in points])
+        return len(points)
+
+    embedded = ordered_map(
+        embed_batch,
+        batch_by_tokens(new_chunks(), length=lambda item: item[2]),
+        EMBEDDING_CONCURRENCY,
+    )
+    points = (
+        [
+            PointStruct(id=id, vector=vector, payload=slim_payload(chunk))
+            for (id, chunk, *_), vector in zip(batch, vectors)
+        ]
+        for batch, vectors in embedded
+    )
+    for _, added in ordered_map(upsert_batch, points):
+        stats["added"] += added
+    # the source is only done once every point is searchable
+    uploader.barrier()
+
+    # an empty load usually means the source failed to load, keep what we have
+    stale_ids = list(existing_ids - ids) if stats["chunks"] else []
+    if stale_ids:
+        with metrics.timer("delete"):
+            client.delete(
                 collection_name,
-                scroll_filter=Filter(
+                points_selector=models.PointIdsList(points=stale_ids),
+            )
+        metrics.count("delete", "points", len(stale_ids))
+        if dedupe:
+            dedupe.remove(stale_ids)
+        if snapshot:
+            snapshot.remove(collection_name, stale_ids)
+    stats["removed"] = len(stale_ids)
+
+    if stats["chunks"]:
+        # documents the source no longer has
+        client.delete(
+            documents_collection_name,
+            points_selector=models.FilterSelector(
+                filter=Filter(
                     must=[
                         FieldCondition(
-                            key="metadata.source",
-                            # match on text because there may be a # in the url
-                            match=MatchText(text=data["source"].replace(".html", "")),
+                            key="queue_source", match=MatchValue(value=source)
                         )
-                    ]
-                ),
-            )
-            if len(results):
-                logging.info(f"⤵️ skipping {data['source']} - already exists")
-                continue
-        else:
-            delete_result = client.delete(
-                collection_name,
-                points_selector=FilterSelector(
-                    filter=models.Filter(
-                        must=[
-                            FieldCondition(
-                                key="metadata.source",
-                                # match on text because there may be a # in the url
-                                match=MatchText(
-                                    text=data["source"].replace(".html", "")
-                                ),
-                            )
-                        ]
-                    )
-                ),
+                    ],
+                    must_not=[HasIdCondition(has_id=list(doc_ids))],
+                )
+            ),
+        )
+        if snapshot:
+            snapshot.remove_stale(documents_collection_name, source, doc_ids)
+
+    return stats
+
+
+def slim_payload(chunk: Document) -> dict:
+    """The text of a chunk and the metadata fields searches filter on"""
+    return {
+        "page_content": chunk.page_content,
+        "metadata": {
+            k: chunk.metadata[k] for k in PAYLOAD_FIELDS if k in chunk.metadata
+        },
+    }
+
+
+def document_id(source: str, doc: Document) -> str:
+    """Stable id of a loaded document (e.g. one section of a guide) of a source"""
+    return str(uuid5(NAMESPACE_URL, f"{source}#doc:{doc.metadata.get('source', '')}"))
+
+
+def document_point(doc_id: str, source: str, doc: Document) -> PointStruct:
+    return PointStruct(
+        id=doc_id,
+        # the documents collection is only ever read by id
+        vector=[1.0],
+        payload={"queue_source": source, "metadata": doc.metadata},
+    )
+
+
+def upsert_documents(
+    client: QdrantClient,
+    points: list[PointStruct],
+    snapshot: VectorSnapshot | None = None,
+):
+    with metrics.timer("upsert.documents"):
+        client.upsert(collection_name=documents_collection_name, points=points)
+    metrics.count("upsert.documents", "points", len(points))
+    if snapshot:
+        snapshot.add(documents_collection_name, points)
+
+
+def canonical_vectors(client: QdrantClient, ids: list[str]) -> dict[str, list[float]]:
+    """Vectors of the canonical points near-duplicate chunks refer to"""
+    if not ids:
+        return {}
+    with metrics.timer("dedupe.retrieve"):
+        points = client.retrieve(
+            collection_name, ids=list(set(ids)), with_payload=False, with_vectors=True
+        )
+    return {str(point.id): point.vector for point in points}
+
+
+def normalize_source(url: str) -> str:
+    """Normalize a source url so queued and stored sources compare exactly"""
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip("/")
+    if path.endswith(".html"):
+        path = path[: -len(".html")]
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), path, parts.query, parts.fragment)
+    )
+
+
+def get_ingested_sources(client: QdrantClient) -> set[str]:
+    """Get every source already in the collection with a single payload-only scroll"""
+    sources: set[str] = set()
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name,
+            limit=1000,
+            offset=offset,
+            with_payload=["metadata.source", "metadata.queue_source"],
+            with_vectors=False,
+        )
+        for point in points:
+            metadata = (point.payload or {}).get("metadata", {})
+            for key in ("queue_source", "source"):
+                if metadata.get(key):
+                    sources.add(normalize_source(metadata[key]))
+        if offset is None:
+            break
+
+    logging.info(f"🔎 found {len(sources)} ingested sources")
+    return sources
+
+
+def point_id(source: str, idx: int, content: str) -> str:
+    """Stable point id derived from the source, chunk position and content"""
+    return str(uuid5(NAMESPACE_URL, f"{source}#{idx}:{content_hash(content)}"))
+
+
+def source_filter(source: str, legacy: bool = True) -> Filter:
+    conditions = [
+        FieldCondition(key="metadata.queue_source", match=MatchValue(value=source))
+    ]
+    if legacy:
+        # points written before queue_source existed, this can't use the
+        # payload indexes so it is left out once there are none
+        conditions.append(
+            FieldCondition(
+                key="metadata.source",
+                # match on text because there may be a # in the url
+                match=MatchText(text=source.replace(".html", "")),
             )
-            logging.info(f"🗑 deleted {delete_result}")
-            logging.info(f"‼️ force adding {data['source']}")
-
-            # if the document was forced, remove the force key
-            if "force" in data:
-                del data["force"]
-            if "update" in data:
-                del data["update"]
-
-            update_queued_data(type, datas)
-
-        if type == "urls":
-            docs = get_documents_from_queued_urls([data])
-        elif type == "docs":
-            docs = get_documents_from_queued_docs([data])
-        elif type == "pdfs":
-            docs = get_docs_from_queued_pdfs([data])
-        else:
-            raise Exception("unknown type")
+        )
+    return Filter(should=conditions)
 
-        new_embeddings = []
 
-        docs_content = [d.page_content for d in docs]
-        batch = 100
-        for i in range(0, len(docs_content), batch):
-            try:
-                logging.info(f"adding documents {i} to {i+batch}")
-                new_embeddings_batch = embed.embed_documents(
-                    docs_content[i : i + batch]
-                )
-                new_embeddings.extend(new_embeddings_batch)
-                time.sleep(0.1)
-            except APIError:
-                logging.error(
-                    "⚠️ openai api error - waiting 60 seconds and retrying..."
-                )
-                time.sleep(30)
-                new_embeddings_batch = embed.embed_documents(
-                    docs_content[i : i + batch]
-                )
-                new_embeddings.extend(new_embeddings_batch)
+@functools.cache
+def has_legacy_points(client: QdrantClient) -> bool:
+    """Whether any point was written before metadata.queue_source existed"""
+    return count_legacy_points(client) > 0
 
-        if not new_embeddings:
-            logging.info(f"⤵️ skipping {data['source']} - no embeddings")
-            continue
 
-        client.upsert(
-            collection_name=collection_name,
-            points=[
-                PointStruct(
-                    id=str(uuid4()),
-                    vector=vector,
-                    payload=docs[idx].dict(),
+def count_legacy_points(client: QdrantClient) -> int:
+    return client.count(
+        collection_name,
+        count_filter=Filter(
+            must=[
+                models.IsEmptyCondition(
+                    is_empty=models.PayloadField(key="metadata.queue_source")
                 )
-                for idx, vector in enumerate(new_embeddings)
-            ],
+            ]
+        ),
+        exact=True,
+    ).count
+
+
+def get_source_point_ids(client: QdrantClient, source: str) -> set[str]:
+    """Get the ids of every point currently stored for a queued source"""
+    ids: set[str] = set()
+    offset = None
+    legacy = has_legacy_points(client)
+    while True:
+        points, offset = client.scroll(
+            collection_name,
+            scroll_filter=source_filter(source, legacy),
+            limit=1000,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False,
         )
+        ids.update(str(p.id) for p in points)
+        if offset is None:
+            return ids
 
-        logging.info(f"🧠 added {len(new_embeddings)} new {type} embeddings")
 
+def create_collection(
+    client: QdrantClient,
+    dimension: int | None = None,
+    name: str = collection_name,
+    documents_name: str = documents_collection_name,
+    model: str | None = None,
+):
+    """Create a collection and its documents collection if they don't exist.
+
+    `model` and `dimension` default to the configured embedding backend's,
+    an existing collection with vectors of another model is refused.
+    """
+    if model is None or dimension is None:
+        configured_model, configured_dimension = embedding_model()
+        model = configured_model if model is None else model
+        dimension = configured_dimension if dimension is None else dimension
 
-def create_collection(client: QdrantClient, dimension: int = 1536):
     collections = client.get_collections()
     collection_names = [c.name for c in collections.collections]
+    collection_names += list(get_aliases(client))
+
+    if name == collection_name and name not in collection_names:
+        # a first run, start the first generation
+        generation, documents_generation = generation_names()
+        create_collection(client, dimension, generation, documents_generation, model)
+        switch_aliases(client, generation, documents_generation)
+        return
 
     # only create collection if it doesn't exist
-    if collection_name not in collection_names:
-        logging.info(f"creating collection {collection_name}")
+    if name not in collection_names:
+        logging.info(f"creating collection {name}")
         client.recreate_collection(
-            collection_name=collection_name,
+            collection_name=name,
             vectors_config=models.VectorParams(
                 size=dimension,
                 distance=models.Distance.COSINE,
             ),
         )
+        create_payload_indexes(client, name, PAYLOAD_INDEXES[collection_name])
+    else:
+        size = client.get_collection(name).config.params.vectors.size
+        if size != dimension:
+            # vectors of another embedding backend can't be searched together
+            raise ValueError(
+                f"collection {name} has {size} dimensional vectors, "
+                f"the embedding backend makes {dimension}"
+            )
+    if documents_name not in collection_names:
+        logging.info(f"creating collection {documents_name}")
+        client.recreate_collection(
+            collection_name=documents_name,
+            vectors_config=models.VectorParams(size=1, distance=models.Distance.DOT),
+        )
+        create_payload_indexes(
+            client, documents_name, PAYLOAD_INDEXES[documents_collection_name]
+        )
+
+    recorded = get_embedding_model(client, name, documents_name)
+    if recorded not in (None, model):
+        # same size vectors of another model would be searched as if they
+        # were comparable
+        raise ValueError(
+            f"collection {name} has {recorded} vectors, "
+            f"the embedding backend makes {model}"
+        )
+    if not client.retrieve(documents_name, ids=[EMBEDDING_POINT_ID]):
+        set_embedding_model(client, documents_name, model, dimension)
+
+
+def get_embedding_model(
+    client: QdrantClient,
+    name: str = collection_name,
+    documents_name: str = documents_collection_name,
+) -> str | None:
+    """The embedding model of a collection's vectors, None while it has none"""
+    points = client.retrieve(documents_name, ids=[EMBEDDING_POINT_ID])
+    if points:
+        return points[0].payload["embedding"]["model"]
+    if client.count(name, exact=False).count:
+        return LEGACY_EMBEDDING_MODEL
+    return None
+
+
+def set_embedding_model(
+    client: QdrantClient, documents_name: str, model: str, dimension: int
+):
+    logging.info(f"🏷 {documents_name} records {model} vectors")
+    client.upsert(
+        collection_name=documents_name,
+        points=[
+            PointStruct(
+                id=EMBEDDING_POINT_ID,
+                vector=[1.0],
+                payload={"embedding": {"model": model, "dimension": dimension}},
+            )
+        ],
+    )
+
+
+def generation_names(timestamp: str | None = None) -> tuple[str, str]:
+    """Names of a generation of the collection and its documents collection"""
+    if timestamp is None:
+        timestamp = time.strftime(GENERATION_FORMAT, time.gmtime())
+    return (
+        f"{collection_name}-{timestamp}",
+        f"{collection_name}-{timestamp}-documents",
+    )
+
+
+def get_aliases(client: QdrantClient) -> dict[str, str]:
+    """Collection each alias points to"""
+    return {a.alias_name: a.collection_name for a in client.get_aliases().aliases}
+
+
+def switch_aliases(
+    client: QdrantClient, name: str, documents_name: str, replace_legacy=False
+):
+    """Point the collection aliases at a generation, in one atomic update"""
+    aliases = get_aliases(client)
+    physical = {c.name for c in client.get_collections().collections}
+    operations = []
+    for alias, target in (
+        (collection_name, name),
+        (documents_collection_name, documents_name),
+    ):
+        if alias in physical:
+            # a collection from before generations, an alias can't share its
+            # name so it goes first, searches fail until the alias exists
+            if not replace_legacy:
+                raise ValueError(
+                    f"{alias} is a collection, not an alias, replace it to switch"
+                )
+            logging.warning(
+                f"🗑 deleting collection {alias} to replace it with an alias"
+            )
+            client.delete_collection(alias)
+        if alias in aliases:
+            operations.append(
+                models.DeleteAliasOperation(
+                    delete_alias=models.DeleteAlias(alias_name=alias)
+                )
+            )
+        operations.append(
+            models.CreateAliasOperation(
+                create_alias=models.CreateAlias(
+                    collection_name=target, alias_name=alias
+                )
+            )
+        )
+    client.update_collection_aliases(change_aliases_operations=operations)
+    logging.info(f"🔀 {collection_name} is now {name}")
+    model = get_embedding_model(client, name, documents_name)
+    if model is not None and model not in OPENAI_DIMENSIONS:
+        logging.warning(
+            f"⚠️ chat embeds questions with openai, it can't search {model} vectors"
+        )
+
+
+def wait_for_index(
+    client: QdrantClient,
+    name: str,
+    expected: int | None = None,
+    timeout: float = 6 * 3600,
+    interval: float = 5.0,
+):
+    """Wait until the optimizer has indexed `expected` vectors of a collection,
+    all of its points by default.
+
+    A collection is GREEN again before the optimizer has picked up new
+    segments, so the status alone says nothing about the index.
+    """
+    start = time.monotonic()
+    while True:
+        info = client.get_collection(name)
+        total = info.points_count if expected is None else expected
+        if info.status == models.CollectionStatus.GREEN and (
+            info.indexed_vectors_count or 0
+        ) >= (total or 0):
+            return
+        if time.monotonic() - start > timeout:
+            raise TimeoutError(
+                f"{name} has {info.indexed_vectors_count} of {total} vectors "
+                f"indexed after {timeout}s"
+            )
+        time.sleep(interval)
+
+
+def collect_generations(client: QdrantClient, keep: int = 1) -> list[str]:
+    """Delete all but the live generation and the `keep` newest before it"""
+    live = set(get_aliases(client).values())
+    generations: dict[str, list[str]] = {}
+    for c in client.get_collections().collections:
+        match = GENERATION_PATTERN.match(c.name)
+        if match and c.name not in live:
+            generations.setdefault(match.group(1), []).append(c.name)
+
+    deleted = []
+    # timestamps sort in time order
+    for timestamp in sorted(generations, reverse=True)[keep:]:
+        for name in generations[timestamp]:
+            logging.info(f"🗑 deleting old generation {name}")
+            client.delete_collection(name)
+            deleted.append(name)
+    return deleted
+
+
+def create_payload_indexes(
+    client: QdrantClient,
+    name: str = collection_name,
+    indexes: dict[str, models.PayloadSchemaType] | None = None,
+) -> list[str]:
+    """Create the payload indexes a collection is missing, returns their fields"""
+    if indexes is None:
+        indexes = PAYLOAD_INDEXES[name]
+    existing = client.get_collection(name).payload_schema
+    created = []
+    for field, schema in indexes.items():
+        if field in existing:
+            continue
+        logging.info(f"🗂 indexing {name} {field} as {schema.value}")
+        with metrics.timer("index.payload"):
+            client.create_payload_index(
+                collection_name=name, field_name=field, field_schema=schema, wait=True
+            )
+        created.append(field)
+    return created
 
 
 def get_documents_from_queued_docs(docs: list[dict] | None = None):
     """Get all queued scraped docs if they exist"""
+    return text_splitter.split_documents(list(iter_documents_from_queued_docs(docs)))
+
+
+def iter_documents_from_queued_docs(
+    docs: list[dict] | None = None,
+) -> Iterator[Document]:
+    """Lazily load each section of the queued scraped docs"""
     if not docs:
         docs = get_queued_data("docs")
     if not docs:
-        return []
+        return
 
     logging.info(f"processing {len(docs)} docs")
 
-    parsed_docs = []
-
     for doc in docs:
         if "source" not in doc:
             logging.warning(f"no source found for {doc}")
@@ -193,22 +1079,17 @@ def get_documents_from_queued_docs(docs: list[dict] | None = None):
 
         try:
             # load the document as json
-            slug = doc["slug"]
-            versions = doc.get("versions", [])
+            # copies, the queued doc is shared by every section
+            versions = list(doc.get("versions", []))
             if "version" in doc:
                 versions.append(doc["version"])
 
-            if not versions:
-                file_name = f"data/queue/docs/{slug}.json"
-            else:
-                file_name = f"data/queue/docs/{slug}-{versions[0]}.json"
-
-            sections = load_file(file_name)
+            sections = read_doc_sections(get_doc_file(doc))
         except Exception as e:
             logging.error(f"failed to parse {doc['source']}: {e}")
             continue
 
-        products = doc.get("products", [])
+        products = list(doc.get("products", []))
         if "product" in doc:
             products.append(doc["product"])
 
@@ -222,7 +1103,8 @@ def get_documents_from_queued_docs(docs: list[dict] | None = None):
             product = products[0].title()
 
         for section in sections:
-            meta = doc
+            # sections are split lazily, so each needs its own metadata
+            meta = dict(doc)
 
             meta.update(
                 {
@@ -234,83 +1116,171 @@ def get_documents_from_queued_docs(docs: list[dict] | None = None):
                     if "header" in section
                     else None,
                     "source": section["url"],
+                    "products": products,
                 }
             )
 
             if versions:
                 meta["versions"] = versions
 
-            sec = Document(
+            metrics.count("load.docs", "documents")
+            metrics.count("load.docs", "bytes", len(section["content"].encode()))
+            yield Document(
                 page_content=section["content"],
                 metadata=meta,
             )
-            parsed_docs.extend(text_splitter.split_documents([sec]))
 
-    return parsed_docs
+
+def get_doc_file(doc: dict) -> str:
+    """The file the scraper saved the sections of a queued doc to.
+
+    A .jsonl crawl is preferred over the .json files of older scrapes. The
+    .jsonl.part of a crawl that did not finish is never read, sections it is
+    missing would be deleted as stale.
+    """
+    versions = doc.get("versions", [])
+    if "version" in doc:
+        versions = versions + [doc["version"]]
+    name = f"{doc['slug']}-{versions[0]}" if versions else doc["slug"]
+    path = f"data/queue/docs/{name}.jsonl"
+    if os.path.exists(path):
+        return path
+    return f"data/queue/docs/{name}.json"
+
+
+def read_doc_sections(path: str) -> Iterator[dict]:
+    """Lazily read the sections of a scraped doc, one line at a time"""
+    if path.endswith(".json"):
+        with metrics.timer("load.docs"):
+            return iter(load_file(path))
+    # open now so a missing file fails here rather than part way through ingest
+    return _read_lines(open(path, "r"))
+
+
+def _read_lines(f) -> Iterator[dict]:
+    with f:
+        for number, line in enumerate(f, 1):
+            with metrics.timer("load.docs"):
+                try:
+                    section = json.loads(line)
+                except json.JSONDecodeError as e:
+                    # the file is incomplete, failing the source keeps the
+                    # stored sections it is missing from being deleted
+                    raise ValueError(f"{f.name} line {number} is truncated") from e
+            yield section
+
+
+def mark_changed_docs(docs: list[dict]) -> list[dict]:
+    """Give docs an "update" key holding a digest of their scraped sections.
+
+    The digest covers the url and content of every section, so it stays the
+    same while a doc's content does and the work queue queues the doc again
+    once its content differs from what was last imported, however many
+    scrapes ran in between.
+    """
+    marked = []
+    for doc in docs:
+        sections = []
+        changed = 0
+        try:
+            for section in read_doc_sections(get_doc_file(doc)):
+                sections.append((section["url"], content_hash(section["content"])))
+                changed += bool(section.get("changed"))
+        except Exception:
+            marked.append(doc)
+            continue
+        if sections:
+            doc = {**doc, "update": content_hash(json.dumps(sections))}
+        if changed:
+            logging.info(f"🔁 {doc['source']} has {changed} changed sections")
+        marked.append(doc)
+    return marked
 
 
 def get_documents_from_queued_urls(urls: list[dict] | None = None) -> list[Document]:
     """Get all urls from the urls.json file in data/queue"""
+    return text_splitter.split_documents(list(iter_documents_from_queued_urls(urls)))
+
+
+def iter_documents_from_queued_urls(
+    urls: list[dict] | None = None,
+    pool: BrowserPool | None = None,
+) -> Iterator[Document]:
     # open the urls.json file and read its contents
     if not urls:
         urls = get_queued_data("urls")
     if not urls:
-        return []
+        return
 
     logging.info(f"processing url {urls[0]['source']} ...")
 
-    loader = PlaywrightURLLoader(
-        urls=[u["source"] for u in urls], remove_selectors=["header", "footer"]
-    )
-    data = loader.load()
-
-    split_docs = text_splitter.split_documents(data)
+    with metrics.timer("load.urls"):
+        if pool:
+            rendered = [pool.render(u["source"]) for u in urls]
+            docs = [doc for doc in rendered if doc]
+        else:
+            loader = PlaywrightURLLoader(
+                urls=[u["source"] for u in urls], remove_selectors=["header", "footer"]
+            )
+            docs = loader.load()
+    metrics.count("load.urls", "documents", len(docs))
+    metrics.count("load.urls", "failures", len(urls) - len(docs))
+    metrics.count("load.urls", "bytes", sum(len(d.page_content.encode()) for d in docs))
 
     # load any metadata from the urls.json file into the document
-    for doc in split_docs:
+    for doc in docs:
         for url in urls:
             if doc.metadata["source"].strip(".") == url["source"].strip("."):
                 doc.metadata.update(url)
                 if "version" in doc.metadata:
                     doc.metadata["versions"] = [doc.metadata["version"]]
-
-    return split_docs
+        yield doc
 
 
 def get_docs_from_queued_pdfs(pdfs: list[dict] | None = None) -> list[Document]:
+    return text_splitter.split_documents(list(iter_docs_from_queued_pdfs(pdfs)))
+
+
+def iter_docs_from_queued_pdfs(
+    pdfs: list[dict] | None = None,
+    fetcher: PDFFetcher | None = None,
+) -> Iterator[Document]:
     # open the urls.json file and read its contents
     if not pdfs:
         pdfs = get_queued_data("pdfs")
     if not pdfs:
-        return []
+        return
 
     logging.info(f"processing pdf {pdfs[0]['source']} ...")
 
-    docs = []
-
     for pdf in pdfs:
         try:
-            loader = OnlinePDFLoader(pdf["source"])
-            doc = loader.load()
+            with metrics.timer("load.pdfs.fetch"):
+                if fetcher:
+                    path = fetcher.fetch(pdf["source"])
+                    metrics.count("load.pdfs.fetch", "bytes", os.path.getsize(path))
+                    loader = UnstructuredPDFLoader(path)
+                else:
+                    loader = OnlinePDFLoader(pdf["source"])
+            with metrics.timer("load.pdfs.parse"):
+                docs = loader.load()
+            metrics.count("load.pdfs.parse", "documents", len(docs))
 
             # replace some boilerplate
-            if doc:
-                doc[0].page_content = (
-                    doc[0]
+            if docs:
+                docs[0].page_content = (
+                    docs[0]
                     .page_content.replace("Cisco Public", "")
                     .replace("All Rights Reserved", "")
                 )
-
-            pages = text_splitter.split_documents(doc)
         except Exception as e:
             logging.error(f"failed to parse {pdf['source']}: {e}")
+            metrics.count("load.pdfs.parse", "failures")
             continue
         # load any metadata from the urls.json file into the document
-        for doc in pages:
+        for doc in docs:
             doc.metadata.update(pdf)
-        docs.extend(pages)
-
-    return docs
+            yield doc
 
 
 def get_queued_data(type: str):
@@ -335,17 +1305,5 @@ def get_queued_data(type: str):
     return data
 
 
-def update_queued_data(type: str, data: list[dict]):
-    # override the existing file with the new data
-    try:
-        with open(f"data/queue/{type}.json", "w") as f:
-            f.write(json.dumps(data))
-    except FileNotFoundError:
-        with open(f"pipeline/data/queue/{type}.json", "w") as f:
-            f.write(json.dumps(data))
-
-    logging.info(f"✅ updated {type}.json")
-
-
 if __name__ == "__main__":
     main()
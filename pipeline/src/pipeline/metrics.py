@@ -0,0 +1,156 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+INGEST_REPORT_PATH = os.getenv("INGEST_REPORT_PATH") or "data/reports"
+INGEST_PROMETHEUS_PATH = os.getenv("INGEST_PROMETHEUS_PATH")
+
+# the queued source being ingested, used to attribute stage timings
+current_source: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "current_source", default=None
+)
+
+
+def _stage():
+    return defaultdict(float)
+
+
+class Metrics:
+    """Per-stage timers and counters for an ingest run, broken down by source.
+
+    Timers record wall and cpu time (cpu time of the calling thread), so the
+    wall time of a stage that runs in several threads at once is the busy
+    time summed across them, not elapsed time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.started_wall = time.perf_counter()
+            self.started_cpu = time.process_time()
+            self.stages: dict[str, dict[str, float]] = defaultdict(_stage)
+            self.sources: dict[str, dict[str, dict[str, float]]] = defaultdict(
+                lambda: defaultdict(_stage)
+            )
+
+    def _targets(self, stage: str) -> list[dict[str, float]]:
+        targets = [self.stages[stage]]
+        source = current_source.get()
+        if source:
+            targets.append(self.sources[source][stage])
+        return targets
+
+    @contextmanager
+    def timer(self, stage: str):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            with self.lock:
+                for target in self._targets(stage):
+                    target["calls"] += 1
+                    target["wall_seconds"] += wall
+                    target["cpu_seconds"] += cpu
+
+    def count(self, stage: str, counter: str, value: float = 1):
+        with self.lock:
+            for target in self._targets(stage):
+                target[counter] += value
+
+    def report(self, slowest: int = 10) -> dict:
+        with self.lock:
+            sources = {
+                source: {stage: dict(values) for stage, values in stages.items()}
+                for source, stages in self.sources.items()
+            }
+            report = {
+                "started": self.started,
+                "wall_seconds": time.perf_counter() - self.started_wall,
+                "cpu_seconds": time.process_time() - self.started_cpu,
+                "stages": {stage: dict(v) for stage, v in self.stages.items()},
+                "sources": sources,
+            }
+
+        totals = {
+            source: sum(v.get("wall_seconds", 0) for v in stages.values())
+            for source, stages in sources.items()
+        }
+        report["slowest_sources"] = [
+            {"source": source, "wall_seconds": seconds}
+            for source, seconds in sorted(totals.items(), key=lambda t: -t[1])[:slowest]
+        ]
+        return report
+
+    def write(
+        self,
+        report_dir: str = INGEST_REPORT_PATH,
+        prometheus_path: str | None = INGEST_PROMETHEUS_PATH,
+        name: str | None = None,
+    ) -> str:
+        """Write the json report, and a prometheus textfile if a path is set.
+
+        `name` tells apart the reports of workers started at the same time.
+        """
+        report = self.report()
+
+        os.makedirs(report_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(report["started"]))
+        if name:
+            stamp = f"{stamp}-{name}"
+        path = os.path.join(report_dir, f"ingest-{stamp}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"📊 wrote run report to {path}")
+
+        for item in report["slowest_sources"][:5]:
+            logging.info(f"🐢 {item['source']} took {item['wall_seconds']:.1f}s")
+
+        if prometheus_path:
+            if name:
+                root, ext = os.path.splitext(prometheus_path)
+                prometheus_path = f"{root}-{name}{ext}"
+            write_prometheus(report, prometheus_path, name)
+        return path
+
+
+def write_prometheus(report: dict, path: str, worker: str | None = None):
+    """Write stage totals in the node_exporter textfile collector format"""
+    total = f'{{worker="{worker}"}}' if worker else ""
+    label = f'worker="{worker}",' if worker else ""
+    lines = [
+        "# HELP pipeline_ingest_wall_seconds Wall time of the last ingest run.",
+        "# TYPE pipeline_ingest_wall_seconds gauge",
+        f"pipeline_ingest_wall_seconds{total} {report['wall_seconds']}",
+        "# HELP pipeline_ingest_cpu_seconds Process cpu time of the last ingest run.",
+        "# TYPE pipeline_ingest_cpu_seconds gauge",
+        f"pipeline_ingest_cpu_seconds{total} {report['cpu_seconds']}",
+        "# HELP pipeline_ingest_stage Per-stage timers and counters of the last ingest run.",
+        "# TYPE pipeline_ingest_stage gauge",
+    ]
+    for stage, values in sorted(report["stages"].items()):
+        for name, value in sorted(values.items()):
+            lines.append(
+                f'pipeline_ingest_stage{{{label}stage="{stage}",metric="{name}"}} {value}'
+            )
+
+    # write then rename so the collector never reads a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+    logging.info(f"📊 wrote prometheus metrics to {path}")
+
+
+metrics = Metrics()
@@ -0,0 +1,41 @@
+"""Bring an existing collection up to date with create_collection.
+
+Adds the payload indexes of pipeline.ingest.PAYLOAD_INDEXES that a
+collection created by an older pipeline is missing, and the documents
+collection if there is none yet, and records the embedding model of
+collections from before it was recorded. Safe to run any number of times.
+
+    rye run migrate
+"""
+import argparse
+import logging
+
+from pipeline import ingest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.parse_args()
+
+    client = ingest.new_qdrant_client()
+    ingest.create_collection(client)
+
+    for name in ingest.PAYLOAD_INDEXES:
+        created = ingest.create_payload_indexes(client, name)
+        if created:
+            logging.info(f"✅ indexed {', '.join(created)} of {name}")
+        else:
+            logging.info(f"✅ {name} already has every payload index")
+
+    legacy = ingest.count_legacy_points(client)
+    if legacy:
+        # source lookups keep a full text match for these until they are
+        # ingested again
+        logging.warning(
+            f"⚠️ {legacy} points have no metadata.queue_source, "
+            "ingest them again with --force to make source lookups use the indexes"
+        )
+
+
+if __name__ == "__main__":
+    main()
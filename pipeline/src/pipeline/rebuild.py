@@ -0,0 +1,205 @@
+"""Rebuild the collections from the local vector snapshot.
+
+Bulk-loads the points of pipeline.snapshot into a new generation of the
+collection (askcisco.com-<timestamp>, and its documents collection) with
+batched uploads running in parallel, so a rebuild only costs disk and
+network time, never an embedding. HNSW indexing is deferred until the load
+is done, then the askcisco.com aliases are switched to the new generation
+in one step and old generations are deleted. Searches keep using the old
+generation, untouched, until the switch.
+
+A rebuild refuses to start while an ingest is running, and refuses to
+switch when the new generation has a different number of points than the
+live collection, e.g. because the snapshot was never filled with
+`rye run snapshot`. A legacy collection is copied into the snapshot before
+it is replaced, since it may hold the only copy of some points.
+
+    rye run rebuild
+    rye run rebuild --keep 2 --no-switch
+"""
+import argparse
+import logging
+import time
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from pipeline import ingest
+from pipeline.metrics import metrics
+from pipeline.snapshot import VectorSnapshot, copy_collection
+from pipeline.upload import UPSERT_BATCH_SIZE, UPSERT_CONCURRENCY, Uploader
+from pipeline.workqueue import WorkQueue
+
+
+def rebuild_collection(
+    client: QdrantClient,
+    snapshot: VectorSnapshot,
+    source: str,
+    target: str,
+    batch_size: int = UPSERT_BATCH_SIZE,
+    concurrency: int = UPSERT_CONCURRENCY,
+) -> int:
+    """Upload the snapshot of collection `source` into collection `target`"""
+    total = snapshot.count(source)
+    uploaded = 0
+    start = time.perf_counter()
+    with Uploader(client, target, batch_size, concurrency, wait=False) as uploader:
+        for points in snapshot.iter_batches(source, batch_size):
+            # create_collection recorded the embedding model already
+            points = [p for p in points if p.id != ingest.EMBEDDING_POINT_ID]
+            uploader.submit(points)
+            uploaded += len(points)
+            if uploaded % (batch_size * 100) < len(points):
+                logging.info(f"⬆️ {target}: {uploaded}/{total} points")
+        uploader.barrier()
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"✅ rebuilt {target} from {source}: {uploaded} points in {elapsed:.1f}s"
+    )
+    return uploaded
+
+
+def count_points(client: QdrantClient, name: str) -> int:
+    """Points of a collection, leaving out the embedding model marker"""
+    return client.count(
+        name,
+        count_filter=models.Filter(
+            must_not=[models.HasIdCondition(has_id=[ingest.EMBEDDING_POINT_ID])]
+        ),
+        exact=True,
+    ).count
+
+
+def set_indexing_threshold(client: QdrantClient, name: str, threshold: int) -> int:
+    """Set the HNSW indexing threshold of a collection, 0 turns indexing off.
+    Returns the threshold it had before.
+    """
+    previous = client.get_collection(name).config.optimizer_config.indexing_threshold
+    client.update_collection(
+        collection_name=name,
+        optimizer_config=models.OptimizersConfigDiff(indexing_threshold=threshold),
+    )
+    return previous
+
+
+def expected_indexed(client: QdrantClient, name: str, dimension: int) -> int:
+    """Vectors of a collection the optimizer is going to index"""
+    info = client.get_collection(name)
+    threshold = info.config.optimizer_config.indexing_threshold
+    # segments under the threshold (kB of vectors) are searched without an
+    # index, nothing in them ever counts as indexed
+    segment_kb = info.points_count * dimension * 4 / 1024 / max(info.segments_count, 1)
+    return info.points_count if segment_kb >= threshold else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--keep",
+        type=int,
+        default=1,
+        help="old generations to keep besides the live one, for rolling back",
+    )
+    parser.add_argument(
+        "--no-switch",
+        action="store_true",
+        help="build the generation but leave the aliases as they are",
+    )
+    parser.add_argument(
+        "--replace-legacy",
+        action="store_true",
+        help="replace an askcisco.com collection from before generations with "
+        "the alias (searches fail for the moment in between)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rebuild while an ingest is running, and switch even if the new "
+        "generation differs from the live collection",
+    )
+    parser.add_argument("--batch-size", type=int, default=UPSERT_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=UPSERT_CONCURRENCY)
+    args = parser.parse_args()
+
+    # points ingest writes during the load would be missing from the new
+    # generation while the queue has them done
+    queue = WorkQueue()
+    claimed = queue.active_claims()
+    queue.close()
+    if claimed and not args.force:
+        raise SystemExit(
+            f"an ingest is running ({claimed} sources claimed), "
+            "rebuild once it is done"
+        )
+
+    client = ingest.new_qdrant_client()
+    physical = {c.name for c in client.get_collections().collections}
+    legacy = ingest.collection_name in physical
+    if legacy and not (args.replace_legacy or args.no_switch):
+        raise SystemExit(
+            f"{ingest.collection_name} is a collection, not an alias, "
+            "pass --replace-legacy to replace it"
+        )
+
+    snapshot = VectorSnapshot()
+    if legacy and args.replace_legacy:
+        # the legacy collection is deleted by the switch, it may hold the only
+        # copy of points the snapshot never got
+        for collection in (ingest.collection_name, ingest.documents_collection_name):
+            copied = copy_collection(client, snapshot, collection)
+            logging.info(f"📸 copied {copied} points of {collection} to the snapshot")
+    dimension = snapshot.dimension(ingest.collection_name)
+    if dimension is None:
+        raise SystemExit(f"no snapshot of {ingest.collection_name} in {snapshot.path}")
+
+    # a generation that is left unswitched is not checked against the live one
+    check = not (args.force or args.no_switch)
+    # the new generation keeps the model of the vectors it is rebuilt from
+    live = legacy or ingest.collection_name in ingest.get_aliases(client)
+    model = ingest.get_embedding_model(client) if live else None
+    name, documents_name = ingest.generation_names()
+    ingest.create_collection(client, dimension, name, documents_name, model)
+
+    # building the graph while points stream in is wasted work, it is built
+    # once over all of them instead
+    threshold = set_indexing_threshold(client, name, 0)
+    for source, target in (
+        (ingest.collection_name, name),
+        (ingest.documents_collection_name, documents_name),
+    ):
+        rows = len(snapshot.vectors(source))
+        uploaded = rebuild_collection(
+            client, snapshot, source, target, args.batch_size, args.concurrency
+        )
+        stored = count_points(client, target)
+        if stored != uploaded:
+            raise SystemExit(f"{target} has {stored} of {uploaded} uploaded points")
+        if check and len(snapshot.vectors(source)) != rows:
+            raise SystemExit(
+                f"the snapshot of {source} was written to during the rebuild, "
+                f"{target} is missing those points"
+            )
+        if check and live:
+            expected = count_points(client, source)
+            if stored != expected:
+                raise SystemExit(
+                    f"{target} has {stored} points, {source} has {expected}, "
+                    "run snapshot to add the missing ones or pass --force"
+                )
+    snapshot.close()
+
+    start = time.perf_counter()
+    set_indexing_threshold(client, name, threshold)
+    ingest.wait_for_index(client, name, expected_indexed(client, name, dimension))
+    logging.info(f"✅ indexed {name} in {time.perf_counter() - start:.1f}s")
+
+    if not args.no_switch:
+        ingest.switch_aliases(
+            client, name, documents_name, replace_legacy=args.replace_legacy
+        )
+        ingest.collect_generations(client, keep=args.keep)
+    metrics.write(name="rebuild")
+
+
+if __name__ == "__main__":
+    main()
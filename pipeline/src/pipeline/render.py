@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import Future
+
+from langchain.schema import Document
+from playwright.async_api import async_playwright
+from unstructured.partition.html import partition_html
+
+RENDER_CONCURRENCY = int(os.getenv("RENDER_CONCURRENCY") or 4)
+# milliseconds, for the whole render of one page
+RENDER_TIMEOUT = int(os.getenv("RENDER_TIMEOUT") or 60_000)
+
+
+class BrowserPool:
+    """One Playwright browser shared by a whole run, rendering pages concurrently.
+
+    Pages render in a pool of `concurrency` browser contexts on an event loop
+    in a background thread. Like PlaywrightURLLoader, matching `remove_selectors`
+    elements are removed before the html is partitioned into text.
+
+        with BrowserPool() as pool:
+            pool.prefetch(urls)
+            doc = pool.render(urls[0])
+    """
+
+    def __init__(
+        self,
+        concurrency: int = RENDER_CONCURRENCY,
+        timeout: int = RENDER_TIMEOUT,
+        remove_selectors: list[str] | None = None,
+        headless: bool = True,
+    ):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.remove_selectors = (
+            remove_selectors if remove_selectors is not None else ["header", "footer"]
+        )
+        self.headless = headless
+        self.prefetched: dict[str, Future] = {}
+        # prefetched urls holding a slot of the window, and ones discarded
+        # before they got one, used on the loop only
+        self.holding: set[str] = set()
+        self.dropped: set[str] = set()
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _run(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def start(self):
+        self.thread.start()
+        self._run(self._start()).result()
+        logging.info(f"🌐 started browser with {self.concurrency} contexts")
+
+    async def _start(self):
+        self.playwright = await async_playwright().start()
+        self.browser = await self.playwright.chromium.launch(headless=self.headless)
+        self.contexts: asyncio.Queue = asyncio.Queue()
+        for _ in range(self.concurrency):
+            await self.contexts.put(await self.browser.new_context())
+        # bounds how many prefetched pages can be rendered but not yet read
+        self.window = asyncio.Semaphore(self.concurrency * 2)
+
+    def close(self):
+        for future in self.prefetched.values():
+            future.cancel()
+        self._run(self._close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def _close(self):
+        await self.browser.close()
+        await self.playwright.stop()
+
+    def prefetch(self, urls: list[str]):
+        """Start rendering urls ahead of time, in order, a window at a time"""
+        for url in urls:
+            if url not in self.prefetched:
+                self.prefetched[url] = self._run(self._render_prefetched(url))
+
+    def render(self, url: str) -> Document | None:
+        """Render one page, returning None if it fails or times out"""
+        future = self.prefetched.pop(url, None)
+        if future is None:
+            return self._run(self._render(url)).result()
+        try:
+            return future.result()
+        finally:
+            self.loop.call_soon_threadsafe(self._release, url)
+
+    def discard(self, url: str):
+        """Drop a prefetched url that is not going to be rendered after all"""
+        if self.prefetched.pop(url, None) is not None:
+            self.loop.call_soon_threadsafe(self._discard, url)
+
+    async def _render_prefetched(self, url: str) -> Document | None:
+        await self.window.acquire()
+        if url in self.dropped:
+            self.dropped.remove(url)
+            self.window.release()
+            return None
+        self.holding.add(url)
+        return await self._render(url)
+
+    def _discard(self, url: str):
+        if url in self.holding:
+            self._release(url)
+        else:
+            self.dropped.add(url)
+
+    def _release(self, url: str):
+        if url in self.holding:
+            self.holding.remove(url)
+            self.window.release()
+
+    async def _render(self, url: str) -> Document | None:
+        context = await self.contexts.get()
+        try:
+            html = await asyncio.wait_for(
+                self._page_content(context, url), self.timeout / 1000
+            )
+        except Exception as e:
+            logging.error(f"failed to render {url}: {e!r}")
+            return None
+        finally:
+            await self.contexts.put(context)
+
+        try:
+            # partitioning is cpu bound, keep it off the event loop
+            text = await asyncio.get_running_loop().run_in_executor(
+                None, html_to_text, html
+            )
+        except Exception as e:
+            logging.error(f"failed to parse {url}: {e!r}")
+            return None
+        return Document(page_content=text, metadata={"source": url})
+
+    async def _page_content(self, context, url: str) -> str:
+        page = await context.new_page()
+        try:
+            await page.goto(url, timeout=self.timeout)
+            for selector in self.remove_selectors:
+                for element in await page.locator(selector).all():
+                    if await element.is_visible():
+                        await element.evaluate("element => element.remove()")
+            return await page.content()
+        finally:
+            await page.close()
+
+
+def html_to_text(html: str) -> str:
+    elements = partition_html(text=html)
+    return "\n\n".join([str(el) for el in elements])
@@ -1,10 +1,14 @@
-import json
 import scrapy
 from scrapy.http import HtmlResponse
 
+from pipeline.scraping.extract import extract_line, extract_text
+from pipeline.scraping.httpcache import is_changed
+from pipeline.scraping.settings import SPIDER_SETTINGS
+
 
 class CiscoDocsSpider(scrapy.Spider):
     allowed_domains = ["www.cisco.com"]
+    custom_settings = SPIDER_SETTINGS
 
     def __init__(self, name, url, versions=None, products=None, *args, **kwargs):
         self.start_urls = [url]
@@ -14,18 +18,7 @@ class CiscoDocsSpider(scrapy.Spider):
 
         super().__init__(*args, **kwargs)
 
-        self.data = []
-
-    def closed(self, reason):
-        filename = (
-            f"data/queue/docs/{self.name}-{self.version[0]}.json"
-            if self.version
-            else f"data/queue/docs/{self.name}.json"
-        )
-        with open(filename, "w") as f:
-            json.dump(self.data, f)
-
-        self.log(f"Saved file {filename}!")
+        self.output_name = f"{name}-{self.version[0]}" if self.version else name
 
     def parse(self, response: HtmlResponse):
         # get all links under ul#bookToc
@@ -43,61 +36,29 @@ class CiscoDocsSpider(scrapy.Spider):
             yield data
 
     def parse_chapter(self, response: HtmlResponse):
-        data = []
-
-        title = response.css("h2.chapter-title::text").getall()
-        title = " ".join([title.strip() for title in title if title.strip()])
-        title = title.replace("\r", "").replace("\t", "").replace("\n", " ")
-        title = " ".join(title.split())
-
-        # get all article.nested1 nodes
-        articles = response.css("article.nested1")
+        title = extract_line(response.css("h2.chapter-title"))
 
         text_data = ""
 
-        for article in articles:
+        # each article.nested1 is a section of the chapter, starting with its h2
+        for article in response.css("article.nested1"):
             if "id" not in article.attrib:
                 continue
-            article_id = article.attrib["id"]
-
-            # header get all text content even from nested tags
-            header = article.css("h2::text").getall()
-            header = " ".join([header.strip() for header in header if header.strip()])
-            header = header.replace("\r", "").replace("\t", "").replace("\n", " ")
-            header = " ".join(header.split())
-
-            # get all text in article
-            text = article.css("::text").getall()
-            # merge all text into one string
-            text = " ".join([text.strip() for text in text if text.strip()])
+            text_data += "\n\n" + extract_text(article)
 
-            # strip consecutive spaces and newlines
-            header = header.replace("\r", "").replace("\t", "").replace("\n", " ")
-            header = " ".join(header.split())
-
-            text = text.replace("\r", "").replace("\t", "").replace("\n", " ")
-            text = " ".join(text.split())
-
-            text_data += "\n\n" + text
-
-        main_title = response.css("h1#fw-pagetitle::text").get()
+        main_title = extract_line(response.css("h1#fw-pagetitle"))
         if main_title:
-            subtitle = title.strip()
-            title = main_title.strip()
+            subtitle = title
+            title = main_title
         else:
             subtitle = None
 
-        d = {
+        yield {
             "products": self.product,
             "versions": self.version,
-            "title": title.strip(),
+            "title": title,
             "subtitle": subtitle,
             "content": text_data,
             "url": response.url,
+            "changed": is_changed(response),
         }
-
-        data.append(d)
-
-        self.data.append(d)
-
-        yield {"data": data}
@@ -1,24 +1,16 @@
-import json
 import scrapy
 from scrapy.http import HtmlResponse
 
+from pipeline.scraping.extract import BOILERPLATE_TAGS, extract_line, extract_text
+from pipeline.scraping.httpcache import is_changed
+from pipeline.scraping.settings import SPIDER_SETTINGS
+
 
 class DuoSpider(scrapy.Spider):
     name = "duo"
     allowed_domains = ["duo.com"]
     start_urls = ["https://duo.com/docs"]
-
-    def __init__(self, name=None, **kwargs):
-        super().__init__(name, **kwargs)
-
-        self.data = []
-
-    def closed(self, reason):
-        filename = f"data/queue/docs/{self.name}.json"
-        with open(filename, "w") as f:
-            json.dump(self.data, f)
-
-        self.log(f"Saved file {filename}!")
+    custom_settings = SPIDER_SETTINGS
 
     def parse(self, response: HtmlResponse):
         links = response.css("#list_introduction > ul > a.index-link")
@@ -34,53 +26,26 @@ class DuoSpider(scrapy.Spider):
             yield response.follow(href, callback=self.parse_chapter)
 
     def parse_chapter(self, response: HtmlResponse):
-        data = []
-        # header get all text content even from nested tags
-        title = response.css("div.content h1::text").get()
-        sections = response.css("div.content h2")
-
-        all_text = ""
-
-        for section in sections:
-            # get all text content even from nested tags
-            header = section.css("*::text").get()
-            # get all text in article
-            text = section.xpath("following-sibling::p/node()").getall()
-            # merge all text into one string
-            text = " ".join([text.strip() for text in text if text.strip()])
-
-            if not header or not text:
-                print("No header or text found")
-                return
-
-            id = header.lower().replace(" ", "-")
-
-            if not title:
-                print("No title found")
-                continue
-
-            title = title.replace("\xa0", " ")
-            text = text.replace("\xa0", " ")
-
-            all_text += text + "\n\n"
-
-        self.data.append(
-            {
-                "title": title,
-                "content": all_text,
-                "url": response.url,
-            }
-        )
-
-        data.append(
-            {
-                "title": title,
-                "content": all_text,
-                "url": response.url,
-            }
+        title = extract_line(response.css("div.content h1"))
+        if not title:
+            print("No title found")
+            return
+
+        # everything but the title, including text directly under the
+        # container, the h2 sections become paragraphs
+        all_text = extract_text(
+            response.css("div.content"), skip=BOILERPLATE_TAGS | {"h1"}
         )
-
-        return data
+        if not all_text:
+            print("No text found")
+            return
+
+        yield {
+            "title": title,
+            "content": all_text,
+            "url": response.url,
+            "changed": is_changed(response),
+        }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+"""HTML to text for the doc spiders.
+
+One walk over the lxml tree collects the text of a node, skipping
+navigation and other boilerplate elements. Headings start their own
+paragraph so the structure of a chapter survives into the text (and the
+splitter prefers to break chunks there); all other whitespace is collapsed
+to single spaces.
+"""
+from typing import Iterable
+
+from lxml import etree
+from parsel import Selector, SelectorList
+
+# elements whose text is never part of the content
+BOILERPLATE_TAGS = frozenset(
+    {
+        "aside",
+        "button",
+        "footer",
+        "form",
+        "iframe",
+        "nav",
+        "noscript",
+        "script",
+        "select",
+        "style",
+        "svg",
+        "template",
+    }
+)
+HEADING_TAGS = frozenset({"h1", "h2", "h3", "h4", "h5", "h6"})
+
+
+def clean_text(text: str) -> str:
+    """Collapse runs of whitespace (including newlines and nbsp) to one space"""
+    return " ".join(text.split())
+
+
+def extract_text(
+    node: Selector | SelectorList | etree._Element,
+    skip: Iterable[str] = BOILERPLATE_TAGS,
+) -> str:
+    """Text of a node, with headings as separate paragraphs"""
+    if isinstance(node, SelectorList):
+        texts = (extract_text(n, skip) for n in node)
+        return "\n\n".join(t for t in texts if t)
+
+    root = node.root if isinstance(node, Selector) else node
+    if not isinstance(root, etree._Element):
+        # a selector for a text node or attribute
+        return clean_text(str(root))
+
+    skip = skip if isinstance(skip, frozenset) else frozenset(skip)
+    blocks: list[str] = []
+    parts: list[str] = []
+
+    def flush():
+        text = clean_text(" ".join(parts))
+        if text:
+            blocks.append(text)
+        parts.clear()
+
+    def walk(element: etree._Element):
+        tag = element.tag
+        # comments and processing instructions have a function as their tag
+        if not isinstance(tag, str) or tag.lower() in skip:
+            return
+        heading = tag.lower() in HEADING_TAGS
+        if heading:
+            flush()
+        if element.text:
+            parts.append(element.text)
+        for child in element:
+            walk(child)
+            # the tail is the parent's text after the child, keep it even
+            # when the child itself was skipped
+            if child.tail:
+                parts.append(child.tail)
+        if heading:
+            flush()
+
+    walk(root)
+    flush()
+    return "\n\n".join(blocks)
+
+
+def extract_line(node: Selector | SelectorList | etree._Element) -> str:
+    """Text of a node on a single line, for titles and headers"""
+    return clean_text(extract_text(node))
@@ -0,0 +1,74 @@
+import os
+
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.extensions.httpcache import RFC2616Policy
+from scrapy.http import Request, Response
+from scrapy.spiders import Spider
+
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR") or "data/cache/http"
+
+# set on responses whose body is the same as the last crawl
+UNCHANGED = "unchanged"
+
+# http cache part of the spider settings, see pipeline.scraping.settings
+HTTP_CACHE_SETTINGS = {
+    "HTTPCACHE_ENABLED": True,
+    "HTTPCACHE_DIR": os.path.abspath(HTTP_CACHE_DIR),
+    "HTTPCACHE_POLICY": "pipeline.scraping.httpcache.RevalidatePolicy",
+    "HTTPCACHE_GZIP": True,
+    # pages without validators are stored too, so a full download can still
+    # be compared with the last crawl
+    "HTTPCACHE_ALWAYS_STORE": True,
+    "HTTPCACHE_IGNORE_HTTP_CODES": list(range(400, 600)),
+    "DOWNLOADER_MIDDLEWARES": {
+        "scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware": None,
+        "pipeline.scraping.httpcache.ChangeTrackingHttpCacheMiddleware": 900,
+    },
+}
+
+
+class RevalidatePolicy(RFC2616Policy):
+    """Always revalidate cached pages with a conditional request.
+
+    Doc sites send little or no cache-control, so instead of guessing how
+    long a page stays fresh every request carries If-None-Match /
+    If-Modified-Since from the cached copy and an unchanged page costs a 304.
+    """
+
+    def is_cached_response_fresh(self, cachedresponse: Response, request: Request):
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+
+class ChangeTrackingHttpCacheMiddleware(HttpCacheMiddleware):
+    """HttpCacheMiddleware that flags responses that did not change.
+
+    A response is unchanged when the server answered 304, or when it sent
+    the same body as the cached copy (servers that ignore validators).
+    """
+
+    def process_response(
+        self, request: Request, response: Response, spider: Spider
+    ) -> Response:
+        cachedresponse = request.meta.get("cached_response")
+        result = super().process_response(request, response, spider)
+        if cachedresponse is not None and (
+            result is cachedresponse or result.body == cachedresponse.body
+        ):
+            self.stats.inc_value("httpcache/unchanged", spider=spider)
+            result.flags.append(UNCHANGED)
+        return result
+
+    def process_exception(
+        self, request: Request, exception: Exception, spider: Spider
+    ) -> Response | None:
+        # the cached copy is served when the site can't be reached
+        result = super().process_exception(request, exception, spider)
+        if result is not None:
+            result.flags.append(UNCHANGED)
+        return result
+
+
+def is_changed(response: Response) -> bool:
+    """Whether a page is new or changed since the last crawl"""
+    return UNCHANGED not in response.flags
@@ -1,12 +1,16 @@
-import json
 import scrapy
 from scrapy.http import HtmlResponse
 
+from pipeline.scraping.extract import extract_line, extract_text
+from pipeline.scraping.httpcache import is_changed
+from pipeline.scraping.settings import SPIDER_SETTINGS
+
 
 class PanopticaSpider(scrapy.Spider):
     name = "panoptica"
     allowed_domains = ["docs.panoptica.app"]
     start_urls = ["https://docs.panoptica.app/docs"]
+    custom_settings = SPIDER_SETTINGS
 
     def __init__(self, url, versions=None, *args, **kwargs):
         self.start_urls = [url]
@@ -15,7 +19,7 @@ class PanopticaSpider(scrapy.Spider):
 
         super().__init__(*args, **kwargs)
 
-        self.data = []
+        self.output_name = f"{self.name}-{self.versions[0]}"
 
     def parse(self, response: HtmlResponse):
         # get all links under ul#bookToc
@@ -31,47 +35,26 @@ class PanopticaSpider(scrapy.Spider):
 
             yield response.follow(href, callback=self.parse_chapter)
 
-    def closed(self, reason):
-        filename = f"data/queue/docs/{self.name}-{self.versions[0]}.json"
-        with open(filename, "w") as f:
-            json.dump(self.data, f)
-
-        self.log(f"Saved file {filename}!")
-
     def parse_chapter(self, response: HtmlResponse):
-        # header get all text content even from nested tags
-        header = response.css("header#content-head h1::text").get()
-
-        # get all text in article
-        text = response.css("div#content-container div.markdown-body *::text").getall()
-        # merge all text into one string
-        text = " ".join([text.strip() for text in text if text.strip()])
+        header = extract_line(response.css("header#content-head h1"))
+        text = extract_text(response.css("div#content-container div.markdown-body"))
 
         if not header or not text:
             print("No header or text found")
             return
 
-        # strip consecutive spaces and newlines
-        header = header.replace("\r", "").replace("\t", "").replace("\n", " ")
-        header = " ".join(header.split())
-        text = text.replace("\r", "").replace("\t", "").replace("\n", " ")
-        text = " ".join(text.split())
-
-        title = f"{header.strip()}"
+        title = header
 
         print(f"Parsed {title} ({response.url})")
 
-        d = {
+        yield {
             "title": "Panoptica Documentation",
             "subtitle": title,
             "content": text,
             "url": response.url,
+            "changed": is_changed(response),
         }
 
-        self.data.append(d)
-
-        yield d
-
 
 if __name__ == "__main__":
     from scrapy.crawler import CrawlerProcess
@@ -0,0 +1,55 @@
+import json
+import os
+
+from scrapy import signals
+from scrapy.crawler import Crawler
+from scrapy.spiders import Spider
+
+DOCS_QUEUE_DIR = "data/queue/docs"
+
+
+def output_path(spider: Spider) -> str:
+    """data/queue/docs/<slug>[-<version>].jsonl for a spider"""
+    name = getattr(spider, "output_name", None) or spider.name
+    return os.path.join(DOCS_QUEUE_DIR, f"{name}.jsonl")
+
+
+class JsonLinesPipeline:
+    """Append each scraped section to the spider's queue file as it arrives.
+
+    Lines go to a .jsonl.part file that is flushed after every item and
+    renamed to .jsonl only once the crawl finishes, so memory stays flat
+    however large a guide is. A crawl that is cancelled or fails leaves its
+    .part behind and the last complete .jsonl in place.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler):
+        pipeline = cls()
+        # only the spider_closed signal says why the crawl stopped
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider: Spider):
+        self.path = output_path(spider)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(f"{self.path}.part", "w")
+        self.count = 0
+
+    def close_spider(self, spider: Spider):
+        self.file.close()
+
+    def spider_closed(self, spider: Spider, reason: str):
+        if reason != "finished":
+            spider.logger.warning(
+                f"Crawl {reason}, left {self.count} sections in {self.path}.part"
+            )
+            return
+        os.replace(f"{self.path}.part", self.path)
+        spider.log(f"Saved {self.count} sections to {self.path}!")
+
+    def process_item(self, item: dict, spider: Spider) -> dict:
+        self.file.write(json.dumps(dict(item)) + "\n")
+        self.file.flush()
+        self.count += 1
+        return item
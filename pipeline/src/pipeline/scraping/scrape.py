@@ -60,12 +60,16 @@ def get_scraped_docs():
     # add each file name to a list and return it
     try:
         for file in os.listdir("data/queue/docs"):
-            if file.endswith(".json"):
-                urls.append(file.replace(".json", ""))
+            # .jsonl.part files are crawls that did not finish
+            name, ext = os.path.splitext(file)
+            if ext in (".json", ".jsonl"):
+                urls.append(name)
     except FileNotFoundError:
         for file in os.listdir("pipeline/data/queue/docs"):
-            if file.endswith(".json"):
-                urls.append(file.replace(".json", ""))
+            # .jsonl.part files are crawls that did not finish
+            name, ext = os.path.splitext(file)
+            if ext in (".json", ".jsonl"):
+                urls.append(name)
     return urls
 
 
@@ -0,0 +1,9 @@
+from pipeline.scraping.httpcache import HTTP_CACHE_SETTINGS
+
+# custom_settings shared by the doc spiders
+SPIDER_SETTINGS = {
+    **HTTP_CACHE_SETTINGS,
+    "ITEM_PIPELINES": {
+        "pipeline.scraping.pipelines.JsonLinesPipeline": 300,
+    },
+}
@@ -1,7 +1,10 @@
-import json
 import scrapy
 from scrapy.http import HtmlResponse
 
+from pipeline.scraping.extract import extract_line, extract_text
+from pipeline.scraping.httpcache import is_changed
+from pipeline.scraping.settings import SPIDER_SETTINGS
+
 
 class UmbrellaSpider(scrapy.Spider):
     name = "umbrella"
@@ -9,11 +12,7 @@ class UmbrellaSpider(scrapy.Spider):
     start_urls = [
         "https://docs.umbrella.com/umbrella-user-guide/docs/start-protecting-your-systems"
     ]
-
-    def __init__(self, name=None, **kwargs):
-        super().__init__(name, **kwargs)
-
-        self.data = []
+    custom_settings = SPIDER_SETTINGS
 
     def parse(self, response: HtmlResponse):
         # get all links under ul#bookToc
@@ -33,32 +32,14 @@ class UmbrellaSpider(scrapy.Spider):
 
             yield response.follow(href, callback=self.parse_chapter)
 
-    def closed(self, reason):
-        filename = f"data/queue/docs/{self.name}.json"
-        with open(filename, "w") as f:
-            json.dump(self.data, f)
-
-        self.log(f"Saved file {filename}!")
-
     def parse_chapter(self, response: HtmlResponse):
-        # header get all text content even from nested tags
-        header = response.css("section#hub-content h1::text").get()
-
-        # get all text in article
-        text = response.css("div#content-container *::text").getall()
-        # merge all text into one string
-        text = " ".join([text.strip() for text in text if text.strip()])
+        header = extract_line(response.css("section#hub-content h1"))
+        text = extract_text(response.css("div#content-container"))
 
         if not header or not text:
             print("No header or text found")
             return
 
-        # strip consecutive spaces and newlines
-        header = header.replace("\r", "").replace("\t", "").replace("\n", " ")
-        header = " ".join(header.split())
-        text = text.replace("\r", "").replace("\t", "").replace("\n", " ")
-        text = " ".join(text.split())
-
         # get parent title from sidebar
         parent = response.xpath(
             "//a[contains(@class, 'subpage active')]//ancestor::li//a//text()"
@@ -71,20 +52,17 @@ class UmbrellaSpider(scrapy.Spider):
             print("No parent or section or header found")
             return
 
-        title = f"{section.strip()} - {parent.strip()} - {header.strip()}"
+        title = f"{section.strip()} - {parent.strip()} - {header}"
 
         print(f"Parsed {title} ({response.url})")
 
-        d = {
+        yield {
             "title": title,
             "content": text,
             "url": response.url,
+            "changed": is_changed(response),
         }
 
-        self.data.append(d)
-
-        yield d
-
 
 if __name__ == "__main__":
     from scrapy.crawler import CrawlerProcess
@@ -0,0 +1,266 @@
+"""Local copy of every vector ingest writes to Qdrant.
+
+Each collection's vectors are appended to a raw float32 matrix
+(data/snapshot/<collection>.f32) that is read back memory-mapped, and an
+SQLite index maps point ids to their row and payload. With it a collection
+can be rebuilt (pipeline.rebuild) without embedding anything again.
+
+Ingest keeps the snapshot up to date as it writes. Points that are already
+in Qdrant but not in the snapshot (e.g. written before it existed) are
+copied in with:
+
+    rye run snapshot
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+import threading
+from typing import Iterator
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from pipeline.db import connect
+
+VECTOR_SNAPSHOT = (os.getenv("VECTOR_SNAPSHOT") or "on") != "off"
+VECTOR_SNAPSHOT_DIR = os.getenv("VECTOR_SNAPSHOT_DIR") or "data/snapshot"
+
+# float32
+ITEM_SIZE = 4
+
+
+class VectorSnapshot:
+    """Append-only vector matrices with an id and payload index.
+
+    A point written again gets a new row and removed points are only
+    dropped from the index, so the old rows stay in the matrix as garbage
+    until the snapshot is written from scratch. Appends hold a file lock, so
+    any number of ingest workers can share one snapshot.
+    """
+
+    def __init__(self, path: str = VECTOR_SNAPSHOT_DIR):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+
+        self.lock = threading.Lock()
+        self.conn = connect(os.path.join(path, "index.sqlite"))
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS collections (
+                name TEXT PRIMARY KEY,
+                dimension INTEGER NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS points (
+                collection TEXT NOT NULL,
+                point_id TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                source TEXT,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (collection, point_id)
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS points_source ON points (collection, source)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS points_row ON points (collection, row)"
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def vectors_path(self, collection: str) -> str:
+        return os.path.join(self.path, f"{collection}.f32")
+
+    def dimension(self, collection: str) -> int | None:
+        row = self.conn.execute(
+            "SELECT dimension FROM collections WHERE name = ?", (collection,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def collections(self) -> list[str]:
+        return [
+            name
+            for (name,) in self.conn.execute(
+                "SELECT name FROM collections ORDER BY name"
+            )
+        ]
+
+    def count(self, collection: str) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM points WHERE collection = ?", (collection,)
+        ).fetchone()[0]
+
+    def add(self, collection: str, points: list[models.PointStruct]):
+        """Append points once they are written to a collection"""
+        if not points:
+            return
+        vectors = np.asarray([p.vector for p in points], dtype=np.float32)
+        dimension = vectors.shape[1]
+        row_size = dimension * ITEM_SIZE
+
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO collections VALUES (?, ?)",
+                    (collection, dimension),
+                )
+            if self.dimension(collection) != dimension:
+                raise ValueError(
+                    f"snapshot of {collection} has {self.dimension(collection)} "
+                    f"dimensional vectors, not {dimension}"
+                )
+
+            with open(self.vectors_path(collection), "ab") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    size = f.seek(0, os.SEEK_END)
+                    start = size // row_size
+                    if size % row_size:
+                        # a write that was cut off, it was never indexed
+                        f.truncate(start * row_size)
+                    f.write(vectors.tobytes())
+                    f.flush()
+                    # rows are only indexed once their vector is on disk
+                    with self.conn:
+                        self.conn.executemany(
+                            "INSERT OR REPLACE INTO points VALUES (?, ?, ?, ?, ?)",
+                            [
+                                (
+                                    collection,
+                                    str(p.id),
+                                    start + i,
+                                    payload_source(p.payload),
+                                    json.dumps(p.payload),
+                                )
+                                for i, p in enumerate(points)
+                            ],
+                        )
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def remove(self, collection: str, point_ids: list[str]):
+        """Forget points that were deleted from a collection"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM points WHERE collection = ? AND point_id = ?",
+                [(collection, str(id)) for id in point_ids],
+            )
+
+    def remove_stale(self, collection: str, source: str, keep: set[str]):
+        """Forget the points of a source that are not in `keep`"""
+        with self.lock:
+            ids = [
+                id
+                for (id,) in self.conn.execute(
+                    "SELECT point_id FROM points WHERE collection = ? AND source = ?",
+                    (collection, source),
+                )
+                if id not in keep
+            ]
+        self.remove(collection, ids)
+
+    def vectors(self, collection: str) -> np.ndarray:
+        """The vector matrix of a collection, memory-mapped read only"""
+        dimension = self.dimension(collection)
+        path = self.vectors_path(collection)
+        if dimension is None or not os.path.exists(path) or not os.path.getsize(path):
+            return np.empty((0, dimension or 0), dtype=np.float32)
+        matrix = np.memmap(path, dtype=np.float32, mode="r")
+        rows = len(matrix) // dimension
+        return matrix[: rows * dimension].reshape(rows, dimension)
+
+    def iter_batches(
+        self, collection: str, batch_size: int = 256
+    ) -> Iterator[list[models.PointStruct]]:
+        """Every point of a collection, in row order so the matrix is read
+        sequentially
+        """
+        vectors = self.vectors(collection)
+        # a connection of its own, so ingest can keep writing while this reads
+        conn = connect(os.path.join(self.path, "index.sqlite"))
+        try:
+            cursor = conn.execute(
+                "SELECT point_id, row, payload FROM points "
+                "WHERE collection = ? AND row < ? ORDER BY row",
+                # rows appended after the matrix was mapped are left out
+                (collection, len(vectors)),
+            )
+            while rows := cursor.fetchmany(batch_size):
+                yield [
+                    models.PointStruct(
+                        id=id, vector=vectors[row].tolist(), payload=json.loads(payload)
+                    )
+                    for id, row, payload in rows
+                ]
+        finally:
+            conn.close()
+
+
+def payload_source(payload: dict) -> str | None:
+    """The queued source a point came from, for chunks and documents alike"""
+    return payload.get("queue_source") or payload.get("metadata", {}).get(
+        "queue_source"
+    )
+
+
+def copy_collection(
+    client: QdrantClient, snapshot: VectorSnapshot, collection: str
+) -> int:
+    """Add the points of a collection that are missing from the snapshot"""
+    known = {
+        id
+        for (id,) in snapshot.conn.execute(
+            "SELECT point_id FROM points WHERE collection = ?", (collection,)
+        )
+    }
+    copied = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection,
+            limit=256,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        missing = [
+            models.PointStruct(id=p.id, vector=p.vector, payload=p.payload)
+            for p in points
+            if str(p.id) not in known
+        ]
+        snapshot.add(collection, missing)
+        copied += len(missing)
+        if offset is None:
+            return copied
+
+
+def main():
+    # imported here, pipeline.ingest writes snapshots itself
+    from pipeline import ingest
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.parse_args()
+
+    client = ingest.new_qdrant_client()
+    snapshot = VectorSnapshot()
+    for collection in (ingest.collection_name, ingest.documents_collection_name):
+        copied = copy_collection(client, snapshot, collection)
+        logging.info(
+            f"📸 copied {copied} points of {collection}, "
+            f"{snapshot.count(collection)} in {snapshot.path}"
+        )
+    snapshot.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import contextvars
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_DONE = object()
+
+
+def prefetch(iterable: Iterable[T], maxsize: int = 2) -> Iterator[T]:
+    """Run an iterable in a background thread, buffering at most `maxsize` items"""
+    buffer: queue.Queue = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                buffer.put((item, None))
+        except BaseException as e:
+            buffer.put((_DONE, e))
+            return
+        buffer.put((_DONE, None))
+
+    # run in the caller's context so context variables (e.g. the source being
+    # ingested) carry over to the producer thread
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(produce,), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stop.set()
+        # unblock the producer if it is waiting on a full buffer
+        while thread.is_alive():
+            try:
+                buffer.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def ordered_map(
+    fn: Callable[[T], R], iterable: Iterable[T], concurrency: int = 1
+) -> Iterator[tuple[T, R]]:
+    """Map `fn` over an iterable on a thread pool, yielding (item, result) in order.
+
+    At most `concurrency` calls run at once and one more item is pulled from
+    the iterable before waiting on the oldest call, so upstream work overlaps
+    with the calls while memory stays bounded.
+    """
+    pending: deque = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            for item in iterable:
+                context = contextvars.copy_context()
+                pending.append((item, executor.submit(context.run, fn, item)))
+                while len(pending) > concurrency:
+                    item, future = pending.popleft()
+                    yield item, future.result()
+            while pending:
+                item, future = pending.popleft()
+                yield item, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
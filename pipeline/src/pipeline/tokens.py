@@ -1,9 +1,20 @@
+import copy
+import os
+from bisect import bisect_right
+from typing import Callable, Iterable, Iterator, TypeVar
+
 import tiktoken
+from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+from pipeline.metrics import metrics
+
 tokenizer_name = tiktoken.encoding_for_model("gpt-3.5-turbo")
 tokenizer = tiktoken.get_encoding(tokenizer_name.name)
 
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS") or 50_000)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE") or 500)
+
 
 # create the length function
 def tiktoken_len(text):
@@ -11,9 +22,185 @@ def tiktoken_len(text):
     return len(tokens)
 
 
-text_splitter = RecursiveCharacterTextSplitter(
+T = TypeVar("T")
+
+WHITESPACE = frozenset(b" \t\r\n")
+
+
+class TokenOffsetTextSplitter:
+    """Split text on token offsets, encoding each document only once.
+
+    Chunks hold at most `chunk_size` tokens. Each chunk ends at the last
+    occurrence of the highest priority separator inside its token window,
+    like RecursiveCharacterTextSplitter, and the next chunk starts up to
+    `chunk_overlap` tokens earlier on a whitespace boundary.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 100,
+        separators: list[str] | None = None,
+        encoding: tiktoken.Encoding = tokenizer,
+    ):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = [
+            s.encode("utf-8") for s in (separators or ["\n\n", "\n", " "]) if s
+        ]
+        self.encoding = encoding
+
+    def split_text(self, text: str) -> list[str]:
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return self._split_tokens(tokens)
+
+    def split_documents(self, documents: list[Document]) -> list[Document]:
+        with metrics.timer("split"):
+            encoded = self.encoding.encode_batch(
+                [d.page_content for d in documents], disallowed_special=()
+            )
+            chunks = []
+            for doc, tokens in zip(documents, encoded):
+                for text in self._split_tokens(tokens):
+                    chunks.append(
+                        Document(
+                            page_content=text, metadata=copy.deepcopy(doc.metadata)
+                        )
+                    )
+
+        metrics.count("split", "documents", len(documents))
+        metrics.count("split", "tokens", sum(len(t) for t in encoded))
+        metrics.count("split", "chunks", len(chunks))
+        return chunks
+
+    def _split_tokens(self, tokens: list[int]) -> list[str]:
+        if not tokens:
+            return []
+
+        pieces = self.encoding.decode_tokens_bytes(tokens)
+        data = b"".join(pieces)
+        # offsets[i] is the byte offset where token i starts
+        offsets = [0]
+        for piece in pieces:
+            offsets.append(offsets[-1] + len(piece))
+
+        n = len(tokens)
+        chunks = []
+        start = 0
+        prev_end = 0
+        while start < n:
+            end = min(start + self.chunk_size, n)
+            if end < n:
+                # every chunk has to reach past the overlap into new text
+                end = self._boundary(data, offsets, max(start, prev_end), end)
+
+            text = self._decode(data, offsets, start, end)
+            # stripping whitespace can re-tokenize the edge words into a few
+            # more tokens, so re-check chunks that are right at the limit
+            while (
+                end - start > self.chunk_size - 8
+                and end - 1 > max(start, prev_end)
+                and len(self.encoding.encode(text, disallowed_special=()))
+                > self.chunk_size
+            ):
+                end = self._boundary(data, offsets, max(start, prev_end), end - 1)
+                text = self._decode(data, offsets, start, end)
+            prev_end = end
+
+            if text:
+                chunks.append(text)
+            if end >= n:
+                break
+            start = self._overlap_start(data, offsets, start, end)
+        return chunks
+
+    @staticmethod
+    def _decode(data: bytes, offsets: list[int], start: int, end: int) -> str:
+        # a character can span tokens, a cut inside one moves back to its
+        # first byte so the next chunk gets all of it
+        text = data[_char_start(data, offsets[start]) : _char_start(data, offsets[end])]
+        return text.decode("utf-8").strip()
+
+    def _boundary(self, data: bytes, offsets: list[int], start: int, end: int) -> int:
+        """Token index after `start` to end a chunk at, or a hard cut at `end`"""
+        for separator in self.separators:
+            pos = data.rfind(separator, offsets[start], offsets[end])
+            if pos == -1:
+                continue
+            boundary = bisect_right(offsets, pos, start, end + 1) - 1
+            # separators can sit inside a token (e.g. ".\n\n"), in which case
+            # the whole token stays with this chunk
+            if offsets[boundary] < pos and boundary < end:
+                boundary += 1
+            if boundary > start:
+                return boundary
+        return end
+
+    def _overlap_start(
+        self, data: bytes, offsets: list[int], start: int, end: int
+    ) -> int:
+        """First token of the next chunk, overlapping on a whitespace boundary"""
+        idx = max(start + 1, end - self.chunk_overlap)
+        while idx < end:
+            offset = offsets[idx]
+            if data[offset] in WHITESPACE or data[offset - 1] in WHITESPACE:
+                return idx
+            idx += 1
+        return end
+
+
+def _char_start(data: bytes, offset: int) -> int:
+    """Move a byte offset back past utf-8 continuation bytes (0b10xxxxxx)"""
+    while 0 < offset < len(data) and data[offset] & 0xC0 == 0x80:
+        offset -= 1
+    return offset
+
+
+text_splitter = TokenOffsetTextSplitter(
+    chunk_size=1000,
+    chunk_overlap=100,
+    separators=["\n\n", "\n", " ", ""],
+)
+
+# the previous splitter, kept for comparison in pipeline.benchmarks.split
+recursive_text_splitter = RecursiveCharacterTextSplitter(
     chunk_size=1000,
     chunk_overlap=100,
     length_function=tiktoken_len,
     separators=["\n\n", "\n", " ", ""],
 )
+
+
+def tiktoken_lens(texts: list[str]) -> list[int]:
+    """Token counts for many texts, encoded in parallel"""
+    return [len(t) for t in tokenizer.encode_batch(texts, disallowed_special=())]
+
+
+def batch_by_tokens(
+    items: Iterable[T],
+    length: Callable[[T], int],
+    max_tokens: int = EMBEDDING_BATCH_TOKENS,
+    max_items: int = EMBEDDING_BATCH_SIZE,
+) -> Iterator[list[T]]:
+    """Lazily pack items into batches by token count.
+
+    Batches are filled in order until adding the next item would go over
+    `max_tokens` or `max_items`. An item larger than `max_tokens` on its own
+    gets a batch to itself.
+    """
+    batch: list[T] = []
+    batch_tokens = 0
+    for item in items:
+        item_tokens = length(item)
+        if batch and (
+            batch_tokens + item_tokens > max_tokens or len(batch) >= max_items
+        ):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(item)
+        batch_tokens += item_tokens
+    if batch:
+        yield batch
@@ -0,0 +1,168 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import grpc
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+
+from pipeline.embeddings import backoff
+from pipeline.metrics import metrics
+
+# points per upsert request, small enough to stay well under the grpc message
+# size limit with 1536 dimensional vectors and chunk payloads
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE") or 128)
+UPSERT_CONCURRENCY = int(os.getenv("UPSERT_CONCURRENCY") or 4)
+UPSERT_MAX_RETRIES = int(os.getenv("UPSERT_MAX_RETRIES") or 5)
+# on: every request waits for qdrant to apply it, off: only for it to be
+# written to the wal, with a barrier at the end of each source
+UPSERT_WAIT = (os.getenv("UPSERT_WAIT") or "off") == "on"
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, UnexpectedResponse):
+        return e.status_code == 429 or e.status_code >= 500
+    if isinstance(e, grpc.RpcError):
+        return e.code() in (
+            grpc.StatusCode.UNAVAILABLE,
+            grpc.StatusCode.DEADLINE_EXCEEDED,
+            grpc.StatusCode.RESOURCE_EXHAUSTED,
+            grpc.StatusCode.ABORTED,
+        )
+    return isinstance(e, ResponseHandlingException)
+
+
+class Uploader:
+    """Uploads points to a collection in batches on a pool of threads.
+
+    Points are split into requests of `batch_size` and up to `concurrency`
+    run at once, each retried on its own. `submit` returns without waiting
+    (at most a few batches per thread are queued), `upload` waits until
+    Qdrant accepted every batch. Without `wait` Qdrant acknowledges a batch
+    once it is in its write-ahead log, `barrier` then blocks until all of
+    them are applied and visible to searches.
+    """
+
+    def __init__(
+        self,
+        client: QdrantClient,
+        collection: str,
+        batch_size: int = UPSERT_BATCH_SIZE,
+        concurrency: int = UPSERT_CONCURRENCY,
+        wait: bool = UPSERT_WAIT,
+        max_retries: int = UPSERT_MAX_RETRIES,
+    ):
+        self.client = client
+        self.collection = collection
+        self.batch_size = batch_size
+        self.wait = wait
+        self.max_retries = max_retries
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.slots = threading.BoundedSemaphore(concurrency * 2)
+        self.lock = threading.Lock()
+        self.pending: set[Future] = set()
+        # the first failed batch, raised by the next flush
+        self.error: BaseException | None = None
+        self.last: list[models.PointStruct] | None = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def submit(self, points: list[models.PointStruct]) -> list[Future]:
+        """Queue points for upload, blocking only while the queue is full"""
+        futures = []
+        for i in range(0, len(points), self.batch_size):
+            batch = points[i : i + self.batch_size]
+            self.slots.acquire()
+            # keeps the current source for the metrics
+            context = contextvars.copy_context()
+            future = self.executor.submit(context.run, self._upsert, batch)
+            with self.lock:
+                self.pending.add(future)
+                self.last = batch
+            future.add_done_callback(self._done)
+            futures.append(future)
+        return futures
+
+    def upload(self, points: list[models.PointStruct]) -> int:
+        """Upload points, returning once Qdrant has accepted all of them"""
+        futures = self.submit(points)
+        wait(futures)
+        errors = [f.exception() for f in futures if f.exception()]
+        if errors:
+            with self.lock:
+                # raised here, not again by the next flush
+                if self.error in errors:
+                    self.error = None
+            raise errors[0]
+        return len(points)
+
+    def flush(self):
+        """Wait for every queued batch, raising the first error"""
+        with self.lock:
+            pending = list(self.pending)
+        wait(pending)
+        with self.lock:
+            error, self.error = self.error, None
+        if error:
+            raise error
+
+    def barrier(self):
+        """Block until everything uploaded so far is applied.
+
+        Qdrant applies updates in the order they reach its log, so sending
+        the last batch again with wait=True returns only once every earlier
+        batch is applied too.
+        """
+        self.flush()
+        # a later barrier with nothing submitted since has nothing to wait for,
+        # rather than re-sending points of an earlier source
+        with self.lock:
+            last, self.last = self.last, None
+        if self.wait or last is None:
+            return
+        with metrics.timer("upsert.barrier"):
+            self._upsert(last, wait=True)
+
+    def _done(self, future: Future):
+        with self.lock:
+            self.pending.discard(future)
+            if not future.cancelled() and future.exception() and not self.error:
+                self.error = future.exception()
+        self.slots.release()
+
+    def _upsert(self, points: list[models.PointStruct], wait: bool | None = None):
+        attempt = 0
+        while True:
+            try:
+                with metrics.timer("upsert"):
+                    self.client.upsert(
+                        collection_name=self.collection,
+                        points=points,
+                        wait=self.wait if wait is None else wait,
+                    )
+                metrics.count("upsert", "points", len(points))
+                metrics.count("upsert", "requests")
+                return len(points)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    metrics.count("upsert", "failures")
+                    raise
+                metrics.count("upsert", "retries")
+                delay = backoff(attempt)
+                attempt += 1
+                logging.warning(
+                    f"⚠️ qdrant upsert error ({e.__class__.__name__}) - "
+                    f"retrying in {delay:.1f}s ({attempt}/{self.max_retries})"
+                )
+                time.sleep(delay)
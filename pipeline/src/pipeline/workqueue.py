@@ -0,0 +1,382 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from pipeline.db import connect
+
+QUEUE_DB_PATH = os.getenv("QUEUE_DB_PATH") or "data/queue/queue.sqlite"
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS") or 3)
+# seconds before an in progress item is assumed to belong to a dead worker
+QUEUE_CLAIM_TIMEOUT = int(os.getenv("QUEUE_CLAIM_TIMEOUT") or 6 * 60 * 60)
+
+# whether an item stopped part way through and has a checkpoint to resume from
+_SELECT = """
+    SELECT items.*,
+        EXISTS (SELECT 1 FROM checkpoints WHERE item_id = items.id) AS resume
+    FROM items
+"""
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+
+class WorkQueue:
+    """SQLite backed ingest queue with a status per item.
+
+    Items move from pending to in progress when a worker claims them and then
+    to done or failed. Claims and status changes are single transactions, so
+    a crash never leaves the queue half written. The data/queue/*.json files
+    stay the place to add entries and are imported with `import_json`.
+
+    Items in progress are also checkpointed: the point ids a source had
+    before it was claimed, and the ids of every batch once it is upserted.
+    A source picked up again after a crash resumes from its checkpoint, so
+    committed batches are neither looked up in Qdrant nor embedded again.
+    """
+
+    def __init__(self, path: str = QUEUE_DB_PATH):
+        self.lock = threading.Lock()
+        # autocommit mode, transactions are opened explicitly
+        self.conn = connect(path, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY,
+                type TEXT NOT NULL,
+                source TEXT NOT NULL,
+                shard_key INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                force INTEGER NOT NULL DEFAULT 0,
+                force_token TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                claimed_at REAL,
+                claimed_by TEXT,
+                UNIQUE (type, source)
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                item_id INTEGER NOT NULL,
+                batch INTEGER NOT NULL,
+                point_ids TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (item_id, batch)
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS items_status ON items (type, status, id)"
+        )
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(items)")}
+        if "force_token" not in columns:
+            # queues from before force tokens were recorded
+            self.conn.execute("ALTER TABLE items ADD COLUMN force_token TEXT")
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """BEGIN IMMEDIATE ... COMMIT, serialised within the process by the lock"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def import_json(self, type: str, entries: list[dict]) -> int:
+        """Add or update queue entries, returning how many became pending.
+
+        New entries start pending. An entry with a "force" or "update" key
+        is queued again with force set whenever the value of that key changes,
+        so a single source is refreshed by setting "force" in the json file to
+        a value it hasn't had yet, e.g. the date. The same value is applied
+        only once however often the file is imported.
+        """
+        now = time.time()
+        queued = 0
+        with self._transaction() as conn:
+            for entry in entries:
+                if "source" not in entry:
+                    continue
+                data = json.dumps(entry, sort_keys=True)
+                force = bool(entry.get("force") or entry.get("update"))
+                token = force_token(entry) if force else None
+                row = conn.execute(
+                    """
+                    SELECT id, data, force_token FROM items
+                    WHERE type = ? AND source = ?
+                    """,
+                    (type, entry["source"]),
+                ).fetchone()
+                if row is None:
+                    conn.execute(
+                        """
+                        INSERT INTO items (
+                            type, source, shard_key, data, force, force_token,
+                            created_at, updated_at
+                        )
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        (
+                            type,
+                            entry["source"],
+                            shard_key(entry["source"]),
+                            data,
+                            int(force),
+                            token,
+                            now,
+                            now,
+                        ),
+                    )
+                    queued += 1
+                elif (
+                    force
+                    and token != row["force_token"]
+                    and not (
+                        # imported before tokens were recorded, already applied
+                        row["force_token"] is None
+                        and row["data"] == data
+                    )
+                ):
+                    conn.execute(
+                        """
+                        UPDATE items SET data = ?, status = ?, force = 1,
+                            force_token = ?, attempts = 0, updated_at = ?
+                        WHERE id = ?
+                        """,
+                        (data, PENDING, token, now, row["id"]),
+                    )
+                    queued += 1
+                elif row["data"] != data or row["force_token"] != token:
+                    conn.execute(
+                        """
+                        UPDATE items SET data = ?, force_token = ?, updated_at = ?
+                        WHERE id = ?
+                        """,
+                        (data, token, now, row["id"]),
+                    )
+
+        logging.info(f"📥 {queued} {type} queued")
+        return queued
+
+    def reset(self, type: str, force: bool = True):
+        """Queue every item of a type again"""
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                UPDATE items SET status = ?, force = ?, attempts = 0, updated_at = ?
+                WHERE type = ?
+                """,
+                (PENDING, int(force), time.time(), type),
+            )
+
+    def requeue(self, max_attempts: int = QUEUE_MAX_ATTEMPTS):
+        """Queue failed items with attempts left and abandoned claims again.
+
+        A claim is abandoned when the process that made it is no longer
+        running on this host, or when it is older than QUEUE_CLAIM_TIMEOUT.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                UPDATE items SET status = ?, updated_at = ?
+                WHERE (status = ? AND attempts < ?)
+                    OR (status = ? AND claimed_at < ?)
+                """,
+                (
+                    PENDING,
+                    now,
+                    FAILED,
+                    max_attempts,
+                    IN_PROGRESS,
+                    now - QUEUE_CLAIM_TIMEOUT,
+                ),
+            )
+            claims = conn.execute(
+                "SELECT id, claimed_by FROM items WHERE status = ?", (IN_PROGRESS,)
+            ).fetchall()
+            dead = [row["id"] for row in claims if _is_dead(row["claimed_by"])]
+            conn.executemany(
+                "UPDATE items SET status = ?, updated_at = ? WHERE id = ?",
+                [(PENDING, now, id) for id in dead],
+            )
+        if dead:
+            logging.info(f"♻️ resuming {len(dead)} interrupted sources")
+
+    def active_claims(self) -> int:
+        """Items claimed by workers that are still running"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT claimed_by, claimed_at FROM items WHERE status = ?",
+                (IN_PROGRESS,),
+            ).fetchall()
+        cutoff = time.time() - QUEUE_CLAIM_TIMEOUT
+        return sum(
+            1
+            for row in rows
+            if row["claimed_at"] >= cutoff and not _is_dead(row["claimed_by"])
+        )
+
+    def claim(self, type: str, shard: tuple[int, int] | None = None) -> dict | None:
+        """Atomically take the next pending item of a type (and shard)"""
+        now = time.time()
+        where, params = _where(type, shard)
+        with self._transaction() as conn:
+            row = conn.execute(
+                _SELECT + where + " ORDER BY id LIMIT 1", params
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                """
+                UPDATE items SET status = ?, attempts = attempts + 1,
+                    claimed_at = ?, claimed_by = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                (IN_PROGRESS, now, _worker_id(), now, row["id"]),
+            )
+        item = self._item(row)
+        item["attempts"] += 1
+        return item
+
+    def checkpoint(self, id: int) -> tuple[set[str], set[str]] | None:
+        """The ids a source had when first claimed and the ids committed since"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT batch, point_ids FROM checkpoints WHERE item_id = ?", (id,)
+            ).fetchall()
+        if not rows:
+            return None
+        existing: set[str] = set()
+        committed: set[str] = set()
+        for batch, point_ids in rows:
+            (existing if batch < 0 else committed).update(json.loads(point_ids))
+        return existing, committed
+
+    def start_checkpoint(self, id: int, existing_ids: set[str]):
+        """Record the ids a source had before ingesting it"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, -1, ?, ?)",
+                (id, json.dumps(sorted(existing_ids)), time.time()),
+            )
+
+    def commit_batch(self, id: int, point_ids: list[str]):
+        """Record a batch of points that has been written to Qdrant"""
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO checkpoints
+                SELECT ?, COALESCE(MAX(batch), -1) + 1, ?, ?
+                FROM checkpoints WHERE item_id = ?
+                """,
+                (id, json.dumps(point_ids), time.time(), id),
+            )
+
+    def complete(self, id: int):
+        self._finish(id, DONE)
+
+    def fail(self, id: int, error: str):
+        self._finish(id, FAILED, error)
+
+    def _finish(self, id: int, status: str, error: str | None = None):
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                UPDATE items SET status = ?, last_error = ?, updated_at = ?,
+                    -- failed items keep their force flag for the retry
+                    force = CASE WHEN ? = 'done' THEN 0 ELSE force END
+                WHERE id = ?
+                """,
+                (status, error, time.time(), status, id),
+            )
+            # failed items keep their checkpoint and resume from it
+            if status == DONE:
+                conn.execute("DELETE FROM checkpoints WHERE item_id = ?", (id,))
+
+    def counts(self, type: str | None = None) -> dict[str, int]:
+        query = "SELECT status, COUNT(*) FROM items"
+        params: tuple = ()
+        if type:
+            query += " WHERE type = ?"
+            params = (type,)
+        with self.lock:
+            rows = self.conn.execute(query + " GROUP BY status", params).fetchall()
+        return {status: count for status, count in rows}
+
+    @staticmethod
+    def _item(row: sqlite3.Row) -> dict:
+        return {
+            "id": row["id"],
+            "type": row["type"],
+            "source": row["source"],
+            "data": json.loads(row["data"]),
+            "status": row["status"],
+            "force": bool(row["force"]),
+            "attempts": row["attempts"],
+            "resume": bool(row["resume"]),
+        }
+
+
+def force_token(entry: dict) -> str:
+    """The force and update values of an entry, queued again when they change"""
+    return json.dumps([entry.get("force"), entry.get("update")], sort_keys=True)
+
+
+def shard_key(source: str) -> int:
+    """Stable hash of a source, `shard_key % N` is the shard it belongs to"""
+    return int(hashlib.sha256(source.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _where(type: str, shard: tuple[int, int] | None) -> tuple[str, tuple]:
+    if shard is None:
+        return "WHERE type = ? AND status = ?", (type, PENDING)
+    index, count = shard
+    return (
+        "WHERE type = ? AND status = ? AND shard_key % ? = ?",
+        (type, PENDING, count, index),
+    )
+
+
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _is_dead(worker: str | None) -> bool:
+    """Whether the process that claimed an item has exited"""
+    if not worker:
+        return True
+    host, _, pid = worker.rpartition(":")
+    if host != socket.gethostname():
+        # can't tell from here, left to QUEUE_CLAIM_TIMEOUT
+        return False
+    if int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pipeline.fetch import PDFFetcher
+
+
+class PDFServer(ThreadingHTTPServer):
+    """Serves `files` (path -> (body, etag)) and answers conditional gets"""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), PDFHandler)
+        self.files: dict[str, tuple[bytes, str]] = {}
+        self.requests: list[tuple[str, int]] = []
+        # set once a request came in, answered `delay` seconds later
+        self.started = threading.Event()
+        self.delay = 0.0
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server_port}{path}"
+
+
+class PDFHandler(BaseHTTPRequestHandler):
+    server: PDFServer
+
+    def do_GET(self):
+        self.server.started.set()
+        time.sleep(self.server.delay)
+        body, etag = self.server.files[self.path]
+        if self.headers.get("If-None-Match") == etag:
+            self.server.requests.append((self.path, 304))
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.server.requests.append((self.path, 200))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = PDFServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def blobs(fetcher: PDFFetcher) -> list[str]:
+    return sorted(f for f in os.listdir(fetcher.blob_dir) if f.endswith(".pdf"))
+
+
+def test_unchanged_pdf_is_revalidated(server, tmp_path):
+    server.files["/a.pdf"] = (b"%PDF-1.4 a", '"v1"')
+
+    with PDFFetcher(str(tmp_path)) as fetcher:
+        first = fetcher.fetch(server.url("/a.pdf"))
+    with PDFFetcher(str(tmp_path)) as fetcher:
+        second = fetcher.fetch(server.url("/a.pdf"))
+        assert (fetcher.downloaded, fetcher.revalidated) == (0, 1)
+
+    assert first == second
+    assert server.requests == [("/a.pdf", 200), ("/a.pdf", 304)]
+
+
+def test_changed_etag_downloads_again(server, tmp_path):
+    server.files["/a.pdf"] = (b"%PDF-1.4 a", '"v1"')
+    with PDFFetcher(str(tmp_path)) as fetcher:
+        first = fetcher.fetch(server.url("/a.pdf"))
+
+    server.files["/a.pdf"] = (b"%PDF-1.4 a, revised", '"v2"')
+    with PDFFetcher(str(tmp_path)) as fetcher:
+        second = fetcher.fetch(server.url("/a.pdf"))
+        assert (fetcher.downloaded, fetcher.revalidated) == (1, 0)
+
+    assert first != second
+    with open(second, "rb") as f:
+        assert f.read() == b"%PDF-1.4 a, revised"
+
+
+def test_identical_pdfs_share_a_blob(server, tmp_path):
+    server.files["/a.pdf"] = (b"%PDF-1.4 same", '"a"')
+    server.files["/b.pdf"] = (b"%PDF-1.4 same", '"b"')
+
+    with PDFFetcher(str(tmp_path)) as fetcher:
+        fetcher.prefetch([server.url("/a.pdf"), server.url("/b.pdf")])
+        a = fetcher.fetch(server.url("/a.pdf"))
+        b = fetcher.fetch(server.url("/b.pdf"))
+        assert a == b
+        assert blobs(fetcher) == [os.path.basename(a)]
+
+
+def test_close_waits_for_running_prefetches(server, tmp_path):
+    server.files["/a.pdf"] = (b"%PDF-1.4 a", '"v1"')
+    server.delay = 0.2
+
+    fetcher = PDFFetcher(str(tmp_path))
+    fetcher.prefetch([server.url("/a.pdf")])
+    server.started.wait()
+    fetcher.close()
+
+    # the download was indexed rather than cut off by the closed index
+    assert fetcher.downloaded == 1
+    with PDFFetcher(str(tmp_path)) as fetcher:
+        fetcher.fetch(server.url("/a.pdf"))
+        assert fetcher.revalidated == 1
@@ -0,0 +1,75 @@
+import re
+
+import pytest
+
+from pipeline.tokens import TokenOffsetTextSplitter, tokenizer
+
+CHUNK_SIZE = 50
+CHUNK_OVERLAP = 10
+
+
+@pytest.fixture
+def splitter():
+    return TokenOffsetTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+def token_len(text: str) -> int:
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+
+def word_numbers(chunk: str) -> list[int]:
+    return [int(n) for n in re.findall(r"word(\d+)", chunk)]
+
+
+def test_chunks_stay_within_chunk_size(splitter):
+    text = "\n\n".join(
+        " ".join(f"word{i}" for i in range(p * 37, (p + 1) * 37)) for p in range(20)
+    )
+
+    chunks = splitter.split_text(text)
+
+    assert len(chunks) > 1
+    assert all(token_len(c) <= CHUNK_SIZE for c in chunks)
+
+
+def test_neighbouring_chunks_overlap(splitter):
+    text = " ".join(f"word{i}" for i in range(500))
+
+    chunks = splitter.split_text(text)
+
+    numbers = [word_numbers(c) for c in chunks]
+    # every chunk is a run of whole words, and together they cover the text
+    for n in numbers:
+        assert n == list(range(n[0], n[-1] + 1))
+    assert numbers[0][0] == 0 and numbers[-1][-1] == 499
+    for prev, next in zip(numbers, numbers[1:]):
+        assert prev[0] < next[0] <= prev[-1]
+        overlap = " ".join(f"word{i}" for i in range(next[0], prev[-1] + 1))
+        assert token_len(overlap) <= CHUNK_OVERLAP
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "déjà vu über café " * 100,
+        "東京都渋谷区" * 100,
+        "👍🏽🇯🇵👨‍👩‍👧" * 100,
+    ],
+    ids=["accents", "cjk", "emoji"],
+)
+def test_multibyte_characters_are_kept_whole(splitter, text):
+    chunks = splitter.split_text(text)
+
+    assert len(chunks) > 1
+    assert all(token_len(c) <= CHUNK_SIZE for c in chunks)
+    if " " in text:
+        # overlapping chunks, each one is a piece of the text
+        assert all(c in text for c in chunks)
+    else:
+        # hard cuts without overlap, nothing is lost in between
+        assert "".join(chunks) == text
+
+
+def test_text_shorter_than_a_chunk(splitter):
+    assert splitter.split_text("  a short text\n") == ["a short text"]
+    assert splitter.split_text("") == []
@@ -0,0 +1,136 @@
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from pipeline import workqueue
+from pipeline.workqueue import DONE, FAILED, IN_PROGRESS, PENDING, WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    yield queue
+    queue.close()
+
+
+def status(queue: WorkQueue, id: int) -> str:
+    return queue.conn.execute(
+        "SELECT status FROM items WHERE id = ?", (id,)
+    ).fetchone()["status"]
+
+
+def test_claims_items_in_order_once(queue):
+    queue.import_json("docs", [{"source": "a"}, {"source": "b"}, {"title": "x"}])
+
+    a = queue.claim("docs")
+    b = queue.claim("docs")
+
+    assert (a["source"], b["source"]) == ("a", "b")
+    assert a["attempts"] == 1 and not a["resume"]
+    assert queue.claim("docs") is None
+    assert queue.counts("docs") == {IN_PROGRESS: 2}
+
+
+def test_complete_and_fail(queue):
+    queue.import_json("docs", [{"source": "a"}, {"source": "b"}])
+    a = queue.claim("docs")
+    b = queue.claim("docs")
+
+    queue.complete(a["id"])
+    queue.fail(b["id"], "no documents")
+
+    assert status(queue, a["id"]) == DONE
+    assert status(queue, b["id"]) == FAILED
+    # failed items with attempts left are retried, done ones are not
+    queue.requeue(max_attempts=2)
+    assert queue.claim("docs")["source"] == "b"
+    queue.fail(b["id"], "no documents")
+    queue.requeue(max_attempts=2)
+    assert queue.claim("docs") is None
+
+
+def test_requeue_takes_back_claims_of_dead_workers(queue):
+    queue.import_json("docs", [{"source": "a"}, {"source": "b"}])
+    a = queue.claim("docs")
+    b = queue.claim("docs")
+    # a worker on this host that has exited since
+    pid = subprocess.check_output(
+        [sys.executable, "-c", "import os; print(os.getpid())"], text=True
+    ).strip()
+    queue.conn.execute(
+        "UPDATE items SET claimed_by = ? WHERE id = ?",
+        (f"{socket.gethostname()}:{pid}", a["id"]),
+    )
+
+    queue.requeue()
+
+    # the claim of the exited process goes back, this process' claim stays
+    assert status(queue, a["id"]) == PENDING
+    assert status(queue, b["id"]) == IN_PROGRESS
+
+
+def test_requeue_takes_back_expired_claims(queue, monkeypatch):
+    queue.import_json("docs", [{"source": "a"}])
+    a = queue.claim("docs")
+    queue.conn.execute(
+        "UPDATE items SET claimed_by = 'elsewhere:1', claimed_at = 0 WHERE id = ?",
+        (a["id"],),
+    )
+    monkeypatch.setattr(workqueue, "QUEUE_CLAIM_TIMEOUT", 60)
+
+    queue.requeue()
+
+    assert status(queue, a["id"]) == PENDING
+
+
+def test_resume_skips_committed_batches(queue):
+    queue.import_json("docs", [{"source": "a"}])
+    a = queue.claim("docs")
+    queue.start_checkpoint(a["id"], {"old-1", "old-2"})
+    queue.commit_batch(a["id"], ["new-1", "new-2"])
+    queue.commit_batch(a["id"], ["new-3"])
+    # the worker dies before completing the source
+    queue.conn.execute(
+        "UPDATE items SET claimed_by = 'elsewhere:1', claimed_at = 0 WHERE id = ?",
+        (a["id"],),
+    )
+    queue.requeue()
+
+    resumed = queue.claim("docs")
+
+    assert resumed["id"] == a["id"] and resumed["resume"]
+    assert resumed["attempts"] == 2
+    existing, committed = queue.checkpoint(a["id"])
+    # the ids from before the first claim decide which points are stale, the
+    # committed ones are neither embedded again nor deleted
+    assert existing == {"old-1", "old-2"}
+    assert committed == {"new-1", "new-2", "new-3"}
+
+
+def test_complete_drops_the_checkpoint(queue):
+    queue.import_json("docs", [{"source": "a"}, {"source": "b"}])
+    a = queue.claim("docs")
+    b = queue.claim("docs")
+    for item in (a, b):
+        queue.start_checkpoint(item["id"], {"old"})
+        queue.commit_batch(item["id"], ["new"])
+
+    queue.complete(a["id"])
+    queue.fail(b["id"], "boom")
+
+    assert queue.checkpoint(a["id"]) is None
+    # failed items resume from where they stopped
+    assert queue.checkpoint(b["id"]) == ({"old"}, {"new"})
+
+
+def test_forced_entries_are_queued_once_per_value(queue):
+    queue.import_json("docs", [{"source": "a", "force": True}])
+    a = queue.claim("docs")
+    assert a["force"]
+    queue.complete(a["id"])
+
+    assert queue.import_json("docs", [{"source": "a", "force": True}]) == 0
+    assert queue.import_json("docs", [{"source": "a", "force": "2026-10-18"}]) == 1
+    assert queue.claim("docs")["force"]
@@ -2,3 +2,31 @@ import { QDRANT_API_KEY,QDRANT_URL } from '$env/static/private';
 import {QdrantClient} from '@qdrant/js-client-rest';
 
 export const qdrantClient = new QdrantClient({url: QDRANT_URL, apiKey: QDRANT_API_KEY});
+
+// the pipeline records the embedding model of the collection in this point of
+// the documents collection, see EMBEDDING_POINT_ID in pipeline/ingest.py
+const EMBEDDING_POINT_ID = 'cf086be7-c6ba-5f4f-b239-a22d80eef1de';
+// collections from before the model was recorded were all embedded with it
+const LEGACY_EMBEDDING_MODEL = 'text-embedding-ada-002';
+// the models questions can be embedded with here
+export const OPENAI_EMBEDDING_MODELS = ['text-embedding-ada-002'];
+
+let embeddingModel: {model: string; expires: number} | undefined;
+
+// the model to embed questions with, looked up again after a minute in case
+// the aliases moved to a generation with another model
+export async function getEmbeddingModel(): Promise<string> {
+  if (embeddingModel && embeddingModel.expires > Date.now()) {
+    return embeddingModel.model;
+  }
+  const points = await qdrantClient.retrieve('askcisco.com-documents', {
+    ids: [EMBEDDING_POINT_ID],
+    with_payload: true
+  });
+  const embedding = points[0]?.payload?.embedding as {model?: string} | undefined;
+  embeddingModel = {
+    model: embedding?.model ?? LEGACY_EMBEDDING_MODEL,
+    expires: Date.now() + 60 * 1000
+  };
+  return embeddingModel.model;
+}
@@ -1,7 +1,11 @@
 import { OPENAI_API_KEY } from "$env/static/private";
 import { ratelimit, redis } from "$lib/db.server";
 import type { DataFilter } from "$lib/types.js";
-import { qdrantClient } from "$lib/vectorstore.server.js";
+import {
+  OPENAI_EMBEDDING_MODELS,
+  getEmbeddingModel,
+  qdrantClient,
+} from "$lib/vectorstore.server.js";
 import type { RequestHandler } from "@sveltejs/kit";
 
 import { OpenAIStream, StreamingTextResponse, type Message } from "ai";
@@ -102,9 +106,18 @@ export const POST: RequestHandler = async ({ request, getClientAddress }) => {
   }
 
   console.log(`Prompt: ${prompt}`);
+  // questions have to be embedded with the model the documents were
+  const embeddingModel = await getEmbeddingModel();
+  if (!OPENAI_EMBEDDING_MODELS.includes(embeddingModel)) {
+    console.error(`Can't embed questions for ${embeddingModel} vectors`);
+    return new Response(
+      "The knowledge base can't be searched right now. Please try again later.",
+      { status: 503 }
+    );
+  }
   const queryEmbedding = await openai.createEmbedding({
     input: prompt,
-    model: "text-embedding-ada-002",
+    model: embeddingModel,
   });
   const embedding = await queryEmbedding.json();
 
@@ -191,12 +204,42 @@ export const POST: RequestHandler = async ({ request, getClientAddress }) => {
         outdated: boolean;
         title?: string;
         subtitle?: string;
+        doc_id?: string;
       };
     };
   }[];
 
   console.log(`Found ${docs.length} documents`);
 
+  // chunks only carry the fields filtered on, the rest of the metadata
+  // (title, subtitle etc.) is stored once per document
+  const docIds = [
+    ...new Set(
+      docs.map((doc) => doc?.payload?.metadata?.doc_id).filter(Boolean)
+    ),
+  ] as string[];
+  if (docIds.length > 0) {
+    const documents = await qdrantClient.retrieve("askcisco.com-documents", {
+      ids: docIds,
+      with_payload: true,
+    });
+    const documentMetadata = new Map(
+      documents.map((document) => [
+        String(document.id),
+        (document.payload?.metadata ?? {}) as Record<string, unknown>,
+      ])
+    );
+    for (const doc of docs) {
+      const docId = doc.payload?.metadata?.doc_id;
+      if (docId && documentMetadata.has(docId)) {
+        doc.payload.metadata = {
+          ...documentMetadata.get(docId),
+          ...doc.payload.metadata,
+        };
+      }
+    }
+  }
+
   // filter out any duplicate sources
   // this is because the sources are chunked
   const docContent = docs